@@ -1,5 +1,41 @@
-from flask import Flask, render_template, Response, jsonify, request
-from flask_socketio import SocketIO, emit
+import os
+
+# Mode server: "threading" (default, dev server Werkzeug) atau "eventlet" / "gevent"
+# untuk produksi: semua stream MJPEG, Socket.IO dan REST jalan di satu event loop
+# kooperatif. Monkey patch harus dilakukan sebelum modul lain di-import.
+ASYNC_MODE = os.environ.get("ASYNC_MODE", "threading")
+# Proses kamera (mode multi-proses, lihat CameraSupervisor) selalu pakai thread biasa:
+# isinya capture, encode dan deteksi yang blocking, tidak ada client yang dilayani
+if os.environ.get("PARKING_ROLE") == "camera":
+    ASYNC_MODE = "threading"
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", "8"))  # thread untuk OpenCV/SQLite di mode async
+if ASYNC_MODE == "eventlet":
+    try:
+        os.environ.setdefault("EVENTLET_THREADPOOL_SIZE", str(BLOCKING_WORKERS))
+        import eventlet
+        eventlet.monkey_patch()
+        from eventlet import tpool
+        NativeLock = eventlet.patcher.original("_thread").allocate_lock
+    except ImportError:
+        print("✗ eventlet not installed, falling back to threading mode")
+        ASYNC_MODE = "threading"
+elif ASYNC_MODE == "gevent":
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+        import gevent
+        blocking_pool = gevent.get_hub().threadpool
+        blocking_pool.maxsize = BLOCKING_WORKERS
+        NativeLock = monkey.get_original("_thread", "allocate_lock")
+    except ImportError:
+        print("✗ gevent not installed, falling back to threading mode")
+        ASYNC_MODE = "threading"
+if ASYNC_MODE not in ("eventlet", "gevent"):
+    ASYNC_MODE = "threading"
+    from threading import Lock as NativeLock
+
+from flask import Flask, render_template, Response, jsonify, request, send_file
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 from io import BytesIO
 import numpy as np
@@ -10,28 +46,118 @@ import time
 import cv2
 import socket
 import requests
-from threading import Thread
+from threading import Thread, Condition, Event, Lock
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, parse_qs
+from contextlib import closing
+from datetime import datetime
+import glob
+import mmap
+import sqlite3
+import queue
+import json
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+import signal
+from multiprocessing import shared_memory, resource_tracker
 
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", 
+# Batas satu frame dari HP (JPEG binary, atau data URL base64 untuk client lama)
+MOBILE_MAX_FRAME_BYTES = 2000000
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
                    ping_timeout=60, ping_interval=25,
-                   max_http_buffer_size=10000000)
+                   max_http_buffer_size=MOBILE_MAX_FRAME_BYTES)
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Jalankan call blocking (OpenCV, SQLite). Mode threading: langsung, karena
+    pemanggil sudah punya thread sendiri. Mode eventlet/gevent: di thread pool
+    berukuran BLOCKING_WORKERS supaya event loop tidak ikut berhenti. fn jalan
+    di OS thread lain, jadi tidak boleh menyentuh Condition/Event (green);
+    lock yang dipakai di dalamnya harus NativeLock.
+    """
+    if ASYNC_MODE == "eventlet":
+        return tpool.execute(fn, *args, **kwargs)
+    if ASYNC_MODE == "gevent":
+        return blocking_pool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
 # variable global untuk mobile camera
-mobile_frames = {}  # Store frames from mobile: {token: frame_data}
-mobile_tokens = {}  # Store active tokens: {token: timestamp}
+mobile_credits = {}  # Frame yang sudah diterima per koneksi binary: {sid: count}
+
+# Batas session HP (token + frame terakhir), lihat MobileSessionStore
+MOBILE_MAX_SESSIONS = 50
+MOBILE_SESSION_TTL = 600       # detik tanpa frame sebelum token hangus
+MOBILE_SWEEP_INTERVAL = 30     # detik antar sweep session expired
+
+# Parameter yang dinegosiasikan ke HP lewat 'mobile_hello'
+MOBILE_MAX_WIDTH = 640      # HP downscale dulu sebelum encode
+MOBILE_JPEG_QUALITY = 0.7
+MOBILE_FRAME_CREDITS = 4    # frame boleh dikirim tanpa menunggu credit baru
+MOBILE_DETECTION_INTERVAL = 1.0  # HP kirim ~6 FPS, deteksi cukup 1x per detik
 
 # Global variables
-cap = None
-camera_url = None
 DEFAULT_WEBCAM_INDEX = 0
-background_frame = None
-slots = []
 PUBLIC_URL = None
 LOCAL_IP = None
-active_camera_id = None
-camera_lock = False
 placeholder_frame = None
+DETECTION_INTERVAL = float(os.environ.get("DETECTION_INTERVAL", "0.5"))  # detik per tick deteksi
+STATUS_LOG_SIZE = 256  # perubahan status terakhir per kamera untuk /status?since=
+STATUS_MAX_WAIT = 30.0  # detik maks /status?wait= (long-poll)
+MOTION_FULL_REFRESH = float(os.environ.get("MOTION_FULL_REFRESH", "30"))  # detik antar deteksi penuh paksa
+HISTORY_DB = os.environ.get("HISTORY_DB", "parking_history.db")
+LAYOUT_DIR = os.environ.get("LAYOUT_DIR", "layouts")  # satu file JSON layout per kamera
+BACKGROUND_DIR = os.environ.get("BACKGROUND_DIR", "backgrounds")  # snapshot background model per kamera
+DETECTION_SCALE = float(os.environ.get("DETECTION_SCALE", "0.5"))  # resolusi deteksi relatif ke kamera
+# Diff BGR (akurasi sama dengan deteksi lama); DETECTION_COLOR=0 = grayscale, lebih hemat CPU/memori
+# tapi mobil yang kecerahannya mirip aspal tidak terlihat (lihat benchmark.py scale)
+DETECTION_COLOR = os.environ.get("DETECTION_COLOR", "1") not in ("0", "false")
+DETECTION_THRESHOLD = int(os.environ.get("DETECTION_THRESHOLD", "25" if DETECTION_COLOR else "10"))
+BACKGROUND_ALPHA = float(os.environ.get("BACKGROUND_ALPHA", "0.05"))  # bobot frame baru per tick
+BACKGROUND_SNAPSHOT_INTERVAL = 60  # detik antar snapshot background ke disk
+# Profil stream /video, urut dari yang paling ringan (dipakai juga sebagai tangga adaptasi)
+STREAM_PROFILES = {
+    "thumbnail": {"quality": 50, "max_width": 320, "fps": 5},
+    "mobile": {"quality": 60, "max_width": 640, "fps": 15},
+    "full": {"quality": 70, "max_width": 1280, "fps": 30},
+}
+DEFAULT_STREAM_PROFILE = os.environ.get("STREAM_PROFILE", "full")
+STREAM_SLOW_SEND = 0.5  # rata-rata waktu kirim > 50% interval frame = client tertinggal
+STREAM_RECOVER_SECONDS = 5.0  # lama kirim lancar sebelum naik satu tingkat lagi
+STREAM_SEND_BUFFER = 64 * 1024  # SO_SNDBUF socket viewer; buffer kernel default (MB) menyembunyikan client lambat
+CLIP_DIR = os.environ.get("CLIP_DIR", "clips")  # ring rekaman + klip transisi per kamera
+RECORD_FPS = float(os.environ.get("RECORD_FPS", "5"))  # frame/detik ke ring rekaman, 0 = tidak merekam
+RECORD_QUALITY = 60
+RECORD_MAX_WIDTH = 640
+RECORDING_RING_BYTES = int(os.environ.get("RECORDING_RING_BYTES", str(64 << 20)))  # file ring per kamera
+RECORDING_RING_FRAMES = 8192  # kapasitas index ring
+CLIP_BEFORE = 5.0  # detik sebelum transisi yang ikut disimpan
+CLIP_AFTER = 5.0  # detik sesudah transisi
+CLIP_MAX_SECONDS = 60.0  # transisi berdekatan digabung sampai panjang ini
+CLIP_MAX_BYTES = int(os.environ.get("CLIP_MAX_BYTES", str(500 << 20)))  # total klip per kamera
+CAMERA_OPEN_TIMEOUT = 5.0  # detik, timeout open/read FFMPEG untuk IP camera
+RECONNECT_BACKOFF_MIN = 0.5  # detik, jeda reconnect pertama; dobel tiap gagal
+RECONNECT_BACKOFF_MAX = 30.0
+# Opsi FFMPEG low-latency untuk RTSP/HTTP (bisa dioverride lewat environment)
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay")
+CAMERA_PROBE_INDICES = range(6)  # index webcam yang dicek /test_camera
+CAMERA_PROBE_TIMEOUT = 3.0  # detik per probe; probe yang lebih lama dianggap tidak tersedia
+CAMERA_DISCOVERY_TTL = 60  # detik sebelum inventaris webcam di-refresh
+# Mode multi-proses: WEB_WORKERS > 1 (butuh ASYNC_MODE eventlet/gevent) menjalankan satu proses
+# capture/deteksi per kamera + WEB_WORKERS proses web yang berbagi port 5000
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+FRAME_RING_SLOTS = 4  # chunk MJPEG terakhir per kamera di shared memory
+FRAME_RING_SLOT_BYTES = int(os.environ.get("FRAME_RING_SLOT_BYTES", str(2 << 20)))  # maks satu chunk
+STATE_RING_SLOTS = 2
+STATE_RING_SLOT_BYTES = 4 << 20  # status + debug kamera (JSON)
+RING_POLL_INTERVAL = 0.005  # detik antar cek chunk baru di web worker
+RING_DEMAND_TIMEOUT = 2.0  # detik tanpa viewer sebelum proses kamera berhenti encode
+REMOTE_SYNC_INTERVAL = 1.0  # detik antar sinkron daftar kamera web worker <-> supervisor
+CAMERA_WORKER_START_TIMEOUT = 15.0  # detik menunggu proses kamera baru siap
 
 def init_placeholder():
     global placeholder_frame
@@ -42,66 +168,797 @@ def init_placeholder():
         _, buffer = cv2.imencode('.jpg', temp)
         placeholder_frame = buffer.tobytes()
 
-def get_camera():
-    global cap, camera_url, DEFAULT_WEBCAM_INDEX
-    if cap is None or not cap.isOpened():
-        max_retries = 3
-        retry_delay = 1  # detik
-        
-        for attempt in range(max_retries):
-            try:
-                if camera_url:  # IP Camera
-                    print(f"Connecting to IP camera: {camera_url} (attempt {attempt + 1}/{max_retries})")
-                    
-                    # Tambah timeout dan buffer untuk IP camera
-                    cap = cv2.VideoCapture(camera_url, cv2.CAP_FFMPEG)
-                    
-                    # Set properties untuk IP camera
-                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)
+class Histogram:
+    """Histogram kumulatif ala Prometheus (bucket tetap, tanpa dependency)"""
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.BUCKETS) and value > self.BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class StageTimer:
+    """with metrics.time("detect", camera=...): ... -> observe durasi ke histogram"""
+
+    __slots__ = ("metrics", "key", "start")
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe_key(self.key, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """
+    Timer & counter ringan untuk hot path (capture, decode, resize, detect,
+    encode, ingest HP, kirim ke client). Dibaca lewat /metrics.
+    """
+
+    def __init__(self):
+        self.lock = NativeLock()  # juga dipakai dari thread pool run_blocking
+        self.histograms = {}  # {(stage, labels): Histogram}
+        self.counters = {}    # {(name, labels): value}
+
+    def time(self, stage, **labels):
+        return StageTimer(self, (stage, tuple(sorted(labels.items()))))
+
+    def observe(self, stage, value, **labels):
+        self.observe_key((stage, tuple(sorted(labels.items()))), value)
+
+    def observe_key(self, key, value):
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+    def render(self, gauges=()):
+        """Format text exposition Prometheus"""
+        with self.lock:
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()]
+            counters = list(self.counters.items())
+
+        lines = [
+            "# HELP parking_stage_seconds Durasi tiap tahap hot path",
+            "# TYPE parking_stage_seconds histogram",
+        ]
+        for (stage, labels), counts, total, count in sorted(histograms):
+            labels = (("stage", stage),) + labels
+            cumulative = 0
+            for bound, n in zip(Histogram.BUCKETS, counts):
+                cumulative += n
+                lines.append(f"parking_stage_seconds_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"parking_stage_seconds_bucket{self.format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"parking_stage_seconds_sum{self.format_labels(labels)} {total}")
+            lines.append(f"parking_stage_seconds_count{self.format_labels(labels)} {count}")
+
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in sorted(counters):
+                if counter_name == name:
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+
+        for name, labels, value in gauges:
+            lines.append(f"{name}{self.format_labels(sorted(labels.items()))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class ReplayCapture:
+    """
+    Sumber kamera dari rekaman: file video, pola image sequence (img_%04d.jpg)
+    atau folder berisi gambar. realtime=True mengikuti FPS asli, False
+    secepat mungkin (untuk benchmark). Kalau loop=True, rekaman diulang.
+    """
+
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, path, realtime=True, loop=True, fps=None):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.images = None
+        self.position = 0
+        self.cap = None
+
+        if os.path.isdir(path):
+            self.images = sorted(f for f in glob.glob(os.path.join(path, "*"))
+                                 if f.lower().endswith(self.IMAGE_EXTENSIONS))
+        else:
+            self.cap = cv2.VideoCapture(path)
+
+        native_fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap is not None else 0
+        self.fps = fps or native_fps or 30.0
+        self.next_time = None
+
+    @classmethod
+    def from_url(cls, url):
+        """file:/path/lot.mp4?realtime=0&loop=1"""
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        flag = lambda name, default: query.get(name, [default])[0] not in ("0", "false", "no")
+        fps = float(query["fps"][0]) if "fps" in query else None
+        return cls(parts.path, realtime=flag("realtime", "1"), loop=flag("loop", "1"), fps=fps)
+
+    def isOpened(self):
+        if self.images is not None:
+            return len(self.images) > 0
+        return self.cap is not None and self.cap.isOpened()
+
+    def _read_raw(self):
+        if self.images is not None:
+            if self.position >= len(self.images):
+                return False, None
+            frame = cv2.imread(self.images[self.position])
+            self.position += 1
+            return frame is not None, frame
+        return self.cap.read()
+
+    def _rewind(self):
+        self.position = 0
+        if self.cap is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def read(self):
+        if self.realtime:
+            now = time.time()
+            if self.next_time is not None and self.next_time > now:
+                time.sleep(self.next_time - now)
+            self.next_time = max(self.next_time or now, now - 1.0) + 1.0 / self.fps
+
+        ret, frame = self._read_raw()
+        if not ret and self.loop:
+            self._rewind()
+            ret, frame = self._read_raw()
+        return ret, frame
+
+    def grab(self):
+        ret, _ = self.read()
+        return ret
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return self.cap.get(prop) if self.cap is not None else 0
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+        else:
+            self.images = []
+
+def is_replay_url(camera_url):
+    return bool(camera_url) and camera_url.startswith("file:")
+
+def get_camera(camera_url=None, webcam_index=DEFAULT_WEBCAM_INDEX):
+    """Buka kamera (IP camera jika camera_url diisi, selain itu webcam index)"""
+    if is_replay_url(camera_url):
+        replay = ReplayCapture.from_url(camera_url)
+        if replay.isOpened():
+            print(f"✓ Replay source opened: {replay.path} ({replay.fps:.1f} FPS, realtime={replay.realtime})")
+            return replay
+        print(f"✗ Replay source not readable: {replay.path}")
+        return None
+
+    # Satu percobaan saja; retry dengan exponential backoff diatur CaptureEngine
+    cap = None
+    try:
+        if camera_url:  # IP Camera
+            print(f"Connecting to IP camera: {camera_url}")
+            timeout_ms = int(CAMERA_OPEN_TIMEOUT * 1000)
+            cap = cv2.VideoCapture(camera_url, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+                                    cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms])
+        else:  # webcam / DroidCam
+            print(f"Connecting to webcam index: {webcam_index}")
+            cap = cv2.VideoCapture(webcam_index)
+
+        # Test apakah kamera benar-benar bisa dibaca
+        if cap.isOpened():
+            ret, test_frame = cap.read()
+            if ret and test_frame is not None:
+                if not camera_url:
+                    # Set properties untuk performa
+                    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+                    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
                     cap.set(cv2.CAP_PROP_FPS, 30)
-                    
-                else:  # webcam / DroidCam
-                    print(f"Connecting to webcam index: {DEFAULT_WEBCAM_INDEX} (attempt {attempt + 1}/{max_retries})")
-                    cap = cv2.VideoCapture(DEFAULT_WEBCAM_INDEX)
-                
-                # Test apakah kamera benar-benar bisa dibaca
-                if cap.isOpened():
-                    ret, test_frame = cap.read()
-                    if ret and test_frame is not None:
-                        # Set properties untuk performa
-                        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                        cap.set(cv2.CAP_PROP_FPS, 30)
-                        
-                        print(f"✓ Camera opened successfully! Frame shape: {test_frame.shape}")
-                        return cap
+
+                print(f"✓ Camera opened successfully! Frame shape: {test_frame.shape}")
+                return cap
+            print(f"✗ Camera opened but cannot read frame")
+        else:
+            print(f"✗ Camera failed to open")
+    except Exception as e:
+        print(f"✗ Error opening camera: {str(e)}")
+
+    if cap is not None:
+        cap.release()
+    print(f"Camera URL: {camera_url}, Webcam Index: {webcam_index}")
+    return None
+
+class CaptureEngine:
+    """
+    Satu thread yang memegang kamera dan decode setiap frame sekali.
+    Semua consumer (/video, /status, /debug, /reset_background) membaca
+    slot frame terbaru (dengan nomor urut) tanpa memanggil cap.read() sendiri.
+    """
+
+    def __init__(self, opener):
+        self.opener = opener  # callable yang mengembalikan cv2.VideoCapture / None
+        self.ip_camera = False
+        self.decode_ema = 0.0  # detik per retrieve (decode + konversi warna)
+        self.frame_interval = 1.0 / 30
+        self.last_grab = None
+        self.dropped = 0
+        self.name = "default"  # label kamera untuk /metrics
+        self.cond = Condition()
+        self.frame = None
+        self.seq = 0
+        self.timestamp = 0.0
+        self.thread = None
+        self.stop_event = Event()
+
+    def start(self):
+        """Jalankan thread capture (idempotent)"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        # Event baru per run supaya thread lama yang belum selesai tetap berhenti
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run, args=(self.stop_event,), daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10.0):
+        """Hentikan thread capture dan kosongkan slot frame"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+        with self.cond:
+            self.frame = None
+            self.cond.notify_all()
+
+    def latest(self):
+        """Ambil (seq, frame) terbaru tanpa blocking"""
+        with self.cond:
+            return self.seq, self.frame
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        """Tunggu sampai ada frame yang lebih baru dari last_seq"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            return self.seq, self.frame
+
+    def _publish(self, frame, timestamp=None):
+        with self.cond:
+            self.frame = frame
+            self.seq += 1
+            self.timestamp = timestamp or time.time()
+            self.cond.notify_all()
+
+    def _reset_timing(self, cam):
+        """Interval awal dari CAP_PROP_FPS sumber (jika valid), dipanggil tiap (re)connect"""
+        fps = cam.get(cv2.CAP_PROP_FPS) if cam is not None and cam.isOpened() else 0
+        self.frame_interval = 1.0 / fps if 0 < fps < 1000 else 1.0 / 30
+        self.last_grab = None
+
+    def _read_live(self, cam):
+        """
+        IP camera: grab terus untuk menguras buffer RTSP/HTTP dan retrieve hanya
+        frame terbaru. Frame yang tiba selama decode terakhir (decode_ema /
+        interval frame) pasti sudah basi dan selalu dibuang; sesudahnya grab
+        yang langsung kembali berarti frame masih menumpuk di buffer (dibuang),
+        grab yang harus menunggu berarti sudah di ujung live. Semua frame
+        sumber di-grab, jadi rata-rata jarak antar grab = interval frame sumber.
+        """
+        # Batas frame berturut-turut yang dibuang: sekitar satu detik video
+        max_skip = max(1, int(1.0 / self.frame_interval))
+        backlog = min(max_skip, int(self.decode_ema / self.frame_interval))
+        skipped = 0
+        while True:
+            start = time.perf_counter()
+            if not run_blocking(cam.grab):
+                return False, None, None
+            grabbed_at = time.time()
+            now = time.perf_counter()
+            waited = now - start
+            # Rata-rata semua jarak antar grab (termasuk yang dikuras), bukan hanya
+            # grab yang menunggu: sumber cepat tidak pernah lolos ambang "live"
+            if self.last_grab is not None:
+                self.frame_interval += 0.05 * (min(now - self.last_grab, 1.0) - self.frame_interval)
+            self.last_grab = now
+            live = waited >= 0.5 * self.frame_interval
+            if (live and skipped >= backlog) or skipped >= max_skip:
+                break
+            skipped += 1
+
+        start = time.perf_counter()
+        ret, frame = run_blocking(cam.retrieve)
+        self.decode_ema += 0.2 * ((time.perf_counter() - start) - self.decode_ema)
+        if skipped:
+            self.dropped += skipped
+            metrics.inc("parking_frames_dropped_total", skipped, camera=self.name)
+        return ret, frame, grabbed_at
+
+    def _run(self, stop_event):
+        cam = run_blocking(self.opener)
+        self._reset_timing(cam)
+        consecutive_failures = 0
+        max_failures = 30
+        backoff = RECONNECT_BACKOFF_MIN
+
+        while not stop_event.is_set():
+            if cam is None or not cam.isOpened():
+                # Exponential backoff: 0.5, 1, 2, ... s, maks RECONNECT_BACKOFF_MAX
+                print(f"Camera disconnected. Reconnecting in {backoff:.1f}s")
+                metrics.inc("parking_camera_reconnects_total", camera=self.name)
+                if stop_event.wait(backoff):
+                    break
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                cam = run_blocking(self.opener)
+                self._reset_timing(cam)
+                consecutive_failures = 0
+                continue
+
+            try:
+                with metrics.time("capture", camera=self.name):
+                    if self.ip_camera:
+                        ret, frame, grabbed_at = self._read_live(cam)
                     else:
-                        print(f"✗ Camera opened but cannot read frame")
-                        cap.release()
-                        cap = None
-                else:
-                    print(f"✗ Camera failed to open")
-                    cap = None
-                
-                # Retry dengan delay
-                if attempt < max_retries - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    
+                        ret, frame = run_blocking(cam.read)
+                        grabbed_at = None
+
+                if not ret or frame is None:
+                    consecutive_failures += 1
+                    metrics.inc("parking_capture_failures_total", camera=self.name)
+                    print(f"Failed to read frame (attempt {consecutive_failures}/{max_failures})")
+
+                    if consecutive_failures >= max_failures:
+                        print("Too many failures, releasing camera...")
+                        cam.release()
+                        cam = None
+                        consecutive_failures = 0
+                    elif stop_event.wait(0.1):
+                        break
+                    continue
+
+                consecutive_failures = 0
+                backoff = RECONNECT_BACKOFF_MIN
+
+                self._publish(frame, grabbed_at)
+                metrics.inc("parking_frames_captured_total", camera=self.name)
+
             except Exception as e:
-                print(f"✗ Error opening camera: {str(e)}")
-                if cap:
-                    cap.release()
-                cap = None
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-        
-        # Jika semua retry gagal
-        print(f"ERROR: Failed to open camera after {max_retries} attempts")
-        print(f"Camera URL: {camera_url}, Webcam Index: {DEFAULT_WEBCAM_INDEX}")
-        return None
-    
-    return cap
+                print(f"Error in capture thread: {str(e)}")
+                consecutive_failures += 1
+                if stop_event.wait(0.1):
+                    break
+
+class MjpegBroadcaster:
+    """
+    Encode JPEG sekali per frame per profil (quality, max_width), lalu
+    chunk multipart yang sama dikirim ke semua viewer. Client yang lambat
+    langsung lompat ke frame terbaru, tidak ada antrian per client.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.name = "default"  # label kamera untuk /metrics
+        self.lock = Condition()
+        self.cache = {}  # {(quality, max_width): (seq, chunk)}
+        self.encoding = set()  # profil yang sedang di-encode thread lain
+        self.encodes = 0
+
+    def next_chunk(self, last_seq, quality=70, max_width=1280, timeout=1.0):
+        """Ambil (seq, chunk multipart) untuk frame yang lebih baru dari last_seq"""
+        seq, frame = self.engine.wait_frame(last_seq, timeout)
+        if frame is None or seq == last_seq:
+            return last_seq, None
+
+        profile = (quality, max_width)
+        with self.lock:
+            # Kalau viewer lain sedang encode frame ini, tunggu hasilnya saja
+            self.lock.wait_for(lambda: profile not in self.encoding, timeout)
+            cached = self.cache.get(profile)
+            if cached is not None and cached[0] >= seq:
+                return cached
+            self.encoding.add(profile)
+
+        chunk = None
+        try:
+            chunk = run_blocking(self._encode, frame, quality, max_width)
+        finally:
+            with self.lock:
+                self.encoding.discard(profile)
+                if chunk is not None:
+                    self.cache[profile] = (seq, chunk)
+                    self.encodes += 1
+                self.lock.notify_all()
+        return seq, chunk
+
+    def _encode(self, frame, quality, max_width):
+        # Resize jika frame terlalu besar (untuk IP camera HD)
+        height, width = frame.shape[:2]
+        if width > max_width:
+            scale = max_width / width
+            with metrics.time("resize", camera=self.name):
+                frame = cv2.resize(frame, None, fx=scale, fy=scale)
+
+        with metrics.time("jpeg_encode", camera=self.name, quality=quality):
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return None
+        return (b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+
+class StreamPacer:
+    """
+    Batasi FPS dan adaptasi kualitas untuk satu viewer /video. Lama yield
+    chunk (generator baru lanjut setelah chunk ditulis ke socket) dipakai
+    sebagai tanda backpressure: kalau rata-ratanya mendekati interval frame,
+    FPS diturunkan dulu, lalu pindah ke profil di bawahnya. Setelah lancar
+    STREAM_RECOVER_SECONDS naik lagi satu tingkat, maksimal profil yang
+    diminta. Semua tingkat memakai profil bernama, jadi encode di
+    broadcaster tetap sekali per profil aktif.
+    """
+
+    def __init__(self, profile, adapt=True):
+        names = list(STREAM_PROFILES)
+        self.steps = []  # [(profil, fps)], indeks 0 = yang diminta
+        for name in reversed(names[:names.index(profile) + 1]):
+            fps = STREAM_PROFILES[name]["fps"]
+            self.steps += [(name, fps), (name, fps / 2)]
+        if not adapt:
+            self.steps = self.steps[:1]
+        self.step = 0
+        self.send_ema = 0.0
+        self.calm = 0.0
+        self.next_at = 0.0
+
+    @property
+    def profile(self):
+        return self.steps[self.step][0]
+
+    @property
+    def interval(self):
+        return 1.0 / self.steps[self.step][1]
+
+    def settings(self):
+        profile = STREAM_PROFILES[self.profile]
+        return profile["quality"], profile["max_width"]
+
+    def wait(self):
+        """Tidur sampai jatah frame berikutnya"""
+        delay = self.next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def sent(self, started, seconds):
+        """Catat satu chunk terkirim; return -1 / 0 / 1 kalau tingkat turun / tetap / naik"""
+        interval = self.interval
+        self.next_at = started + interval
+        self.send_ema = 0.8 * self.send_ema + 0.2 * seconds
+        if self.send_ema > interval * STREAM_SLOW_SEND:
+            self.calm = 0.0
+            if self.step + 1 < len(self.steps):
+                self.step += 1
+                self.send_ema = 0.0
+                return -1
+        elif self.send_ema < interval * STREAM_SLOW_SEND / 4:
+            self.calm += interval
+            if self.calm >= STREAM_RECOVER_SECONDS and self.step > 0:
+                self.step -= 1
+                self.calm = 0.0
+                return 1
+        return 0
+
+class MobileFrameSource:
+    """
+    Sumber frame dari HP untuk deteksi. Handler Socket.IO hanya menyimpan
+    bytes JPEG; decode dilakukan lazy (saat deteksi butuh) langsung ke
+    resolusi setengah dengan IMREAD_REDUCED_COLOR_2.
+    """
+
+    scale = 0.5  # sesuai IMREAD_REDUCED_COLOR_2
+
+    def __init__(self, token):
+        self.token = token
+        self.cond = Condition()
+        self.jpeg = None
+        self.seq = 0
+        self.timestamp = 0.0
+        self.decoded_seq = 0
+        self.decoded = None
+        self.chunk_seq = 0
+        self.chunk = None  # chunk multipart untuk /mobile_video, dibuat sekali per frame
+        self.created = time.time()
+        self.closed = False
+
+    def last_seen(self):
+        return max(self.created, self.timestamp)
+
+    def nbytes(self):
+        """Memori yang dipegang session: JPEG mentah + frame hasil decode"""
+        size = len(self.jpeg) if self.jpeg is not None else 0
+        if self.decoded is not None:
+            size += self.decoded.nbytes
+        if self.chunk is not None and self.chunk_seq == self.seq:
+            size += len(self.chunk)
+        return size
+
+    def close(self):
+        """Lepas frame dan bangunkan semua generator MJPEG supaya berhenti"""
+        with self.cond:
+            self.closed = True
+            self.jpeg = None
+            self.decoded = None
+            self.chunk = None
+            self.cond.notify_all()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def push(self, jpeg):
+        """Dipanggil dari handler Socket.IO: O(1), tanpa decode"""
+        with self.cond:
+            self.jpeg = jpeg
+            self.seq += 1
+            self.timestamp = time.time()
+            self.cond.notify_all()
+
+    def latest(self):
+        with self.cond:
+            seq, jpeg = self.seq, self.jpeg
+            if seq == self.decoded_seq:
+                return seq, self.decoded
+
+        frame = None
+        if jpeg is not None:
+            with metrics.time("decode", camera="mobile"):
+                frame = run_blocking(cv2.imdecode, np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+
+        with self.cond:
+            if seq > self.decoded_seq:
+                self.decoded_seq, self.decoded = seq, frame
+        return seq, frame
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+        return self.latest()
+
+    def wait_chunk(self, last_seq, timeout=1.0):
+        """
+        Blok sampai HP kirim frame baru lalu kembalikan (seq, chunk multipart).
+        Chunk dibuat sekali per frame dan di-share ke semua viewer.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq or self.closed, timeout)
+            if self.closed or self.jpeg is None or self.seq == last_seq:
+                return last_seq, None
+            if self.chunk_seq != self.seq:
+                self.chunk = (b'--frame\r\n'
+                              b'Content-Type: image/jpeg\r\n\r\n' + self.jpeg + b'\r\n')
+                self.chunk_seq = self.seq
+            return self.seq, self.chunk
+
+class MobileSessionStore:
+    """
+    Session HP (token -> MobileFrameSource) dengan batas jumlah (LRU),
+    TTL sejak frame terakhir, dan batas ukuran frame per session.
+    Sweeper menutup session expired beserta generator MJPEG-nya.
+    """
+
+    def __init__(self, max_sessions=MOBILE_MAX_SESSIONS, ttl=MOBILE_SESSION_TTL,
+                 max_frame_bytes=MOBILE_MAX_FRAME_BYTES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_frame_bytes = max_frame_bytes
+        self.lock = Lock()
+        self.sessions = OrderedDict()  # urutan = LRU (paling lama di depan)
+        self.sweeper = None
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def create(self, token):
+        session = MobileFrameSource(token)
+        evicted = []
+        with self.lock:
+            self.sessions[token] = session
+            while len(self.sessions) > self.max_sessions:
+                evicted.append(self.sessions.popitem(last=False)[1])
+        for old in evicted:
+            print(f"Mobile session {old.token} evicted (limit {self.max_sessions})")
+            old.close()
+        self.start_sweeper()
+        return session
+
+    def get(self, token):
+        with self.lock:
+            session = self.sessions.get(token)
+        if session is None or session.closed:
+            return None
+        if time.time() - session.last_seen() > self.ttl:
+            self.close(token)
+            return None
+        return session
+
+    def push(self, token, frame_bytes):
+        """Simpan frame baru; False kalau token tidak valid / frame melebihi batas"""
+        if not frame_bytes or len(frame_bytes) > self.max_frame_bytes:
+            return False
+        session = self.get(token)
+        if session is None:
+            return False
+        session.push(frame_bytes)
+        with self.lock:
+            if token in self.sessions:
+                self.sessions.move_to_end(token)
+        return True
+
+    def close(self, token):
+        with self.lock:
+            session = self.sessions.pop(token, None)
+        if session is not None:
+            session.close()
+        return session is not None
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            expired = [token for token, session in self.sessions.items()
+                       if session.closed or now - session.last_seen() > self.ttl]
+        for token in expired:
+            print(f"Mobile session {token} expired")
+            self.close(token)
+        return len(expired)
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {
+            "sessions": len(sessions),
+            "bytes": sum(session.nbytes() for session in sessions)
+        }
+
+    def start_sweeper(self):
+        if self.sweeper is not None and self.sweeper.is_alive():
+            return
+        self.sweeper = Thread(target=self._sweep_loop, daemon=True)
+        self.sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(MOBILE_SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error in mobile session sweeper: {str(e)}")
+
+mobile_sessions = MobileSessionStore()
+
+class CameraDiscovery:
+    """
+    Inventaris webcam lokal. Semua index dicek paralel di background dengan
+    timeout per probe, hasilnya dicache CAMERA_DISCOVERY_TTL detik. Pemanggil
+    (/test_camera, startup) tidak pernah menunggu probe selesai.
+    """
+
+    def __init__(self, indices=CAMERA_PROBE_INDICES, timeout=CAMERA_PROBE_TIMEOUT, ttl=CAMERA_DISCOVERY_TTL):
+        self.indices = list(indices)
+        self.timeout = timeout
+        self.ttl = ttl
+        self.lock = Lock()
+        self.cameras = []
+        self.timed_out = []
+        self.updated = 0.0
+        self.refreshing = False
+        self.pending = {}  # {index: future} probe yang belum selesai (mis. driver macet)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.indices), thread_name_prefix="camera-probe")
+
+    @staticmethod
+    def probe(index):
+        test_cap = cv2.VideoCapture(index)
+        try:
+            if test_cap.isOpened():
+                ret, frame = test_cap.read()
+                if ret:
+                    return {"index": index, "type": "webcam",
+                            "resolution": f"{frame.shape[1]}x{frame.shape[0]}"}
+            return None
+        finally:
+            test_cap.release()
+
+    def refresh(self):
+        """Mulai refresh di background (no-op kalau sedang berjalan)"""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            futures = {}
+            for index in self.indices:
+                # Probe lama yang masih macet tidak diulang, supaya worker tidak habis
+                future = self.pending.get(index)
+                if future is None or future.done():
+                    future = self.executor.submit(run_blocking, self.probe, index)
+                    self.pending[index] = future
+                futures[future] = index
+            wait(futures, timeout=self.timeout)
+
+            cameras, timed_out = [], []
+            for future, index in futures.items():
+                if not future.done():
+                    timed_out.append(index)
+                elif future.exception() is None and future.result() is not None:
+                    cameras.append(future.result())
+            cameras.sort(key=lambda cam: cam["index"])
+
+            with self.lock:
+                self.cameras = cameras
+                self.timed_out = sorted(timed_out)
+                self.updated = time.time()
+            found = ", ".join(str(cam["index"]) for cam in cameras) or "none"
+            print(f"✓ Camera discovery: available [{found}], timed out {sorted(timed_out)}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def inventory(self, force=False):
+        """Snapshot inventaris sekarang; refresh async kalau sudah basi"""
+        if force or time.time() - self.updated >= self.ttl:
+            self.refresh()
+        with self.lock:
+            return {
+                "available_cameras": list(self.cameras),
+                "total": len(self.cameras),
+                "timed_out": list(self.timed_out),
+                "updated": self.updated or None,
+                "refreshing": self.refreshing
+            }
+
+camera_discovery = CameraDiscovery()
 
 def get_local_ip():
     """Dapatkan IP lokal komputer"""
@@ -137,58 +994,13 @@ def index():
 
 @app.route("/set_camera", methods=["POST"])
 def set_camera():
-    global cap, camera_url, DEFAULT_WEBCAM_INDEX, background_frame, camera_lock
     data = request.get_json()
-    ip = data.get("ip")
-    idx = data.get("index")
+    camera_id = data.get("id") or "default"
+    print(f"Setting camera {camera_id} - IP: {data.get('ip')}, Index: {data.get('index')}")
 
-    print(f"Setting camera - IP: {ip}, Index: {idx}")
-
-    # Lock to prevent race conditions
-    camera_lock = True
-    
-    try:
-        # Release current camera
-        if cap is not None:
-            cap.release()
-            cap = None
-            time.sleep(0.5)
-
-        # Set new camera
-        camera_url = ip if ip else None
-        if idx is not None and not ip:
-            try:
-                DEFAULT_WEBCAM_INDEX = int(idx)
-            except:
-                DEFAULT_WEBCAM_INDEX = 0
-
-        # Reset background when camera changes
-        background_frame = None
-        
-        # Initialize new camera
-        cam = get_camera()
-        if cam and cam.isOpened():
-            ret, frame = cam.read()
-            if ret:
-                print(f"Camera test successful! Frame shape: {frame.shape}")
-                return jsonify({
-                    "status": "ok", 
-                    "camera": camera_url or f"webcam {DEFAULT_WEBCAM_INDEX}",
-                    "resolution": f"{frame.shape[1]}x{frame.shape[0]}"
-                })
-            else:
-                print("Camera opened but cannot read frame")
-                return jsonify({
-                    "status": "error", 
-                    "message": "Camera opened but cannot read frame"
-                }), 400
-        else:
-            return jsonify({
-                "status": "error", 
-                "message": "Failed to open camera"
-            }), 400
-    finally:
-        camera_lock = False
+    # Kamera lain tetap jalan; yang ini jadi target route lama
+    camera_manager.active_id = camera_id
+    return register_camera_response(camera_id, data)
 
 @app.route("/generate_mobile_link", methods=["POST"])
 def generate_mobile_link():
@@ -196,7 +1008,7 @@ def generate_mobile_link():
     global LOCAL_IP, PUBLIC_URL
     
     token = secrets.token_urlsafe(16)
-    mobile_tokens[token] = time.time()
+    mobile_sessions.create(token)
     
     # Deteksi mode: lokal atau online
     if PUBLIC_URL:
@@ -231,7 +1043,7 @@ def generate_mobile_link():
 @app.route("/mobile/<token>")
 def mobile_camera(token):
     """Mobile camera page - hanya bisa diakses via tunnel"""
-    if token not in mobile_tokens:
+    if token not in mobile_sessions:
         return "Invalid or expired token", 403
     
     # Cek apakah menggunakan tunnel (bukan localhost/IP lokal)
@@ -294,274 +1106,2745 @@ def mobile_camera(token):
 @app.route("/mobile_video/<token>")
 def mobile_video(token):
     """Stream dari mobile camera"""
+    session = mobile_sessions.get(token)
+    if session is None:
+        return "Invalid or expired token", 404
+    init_placeholder()
+
     def generate():
-        while True:
-            if token in mobile_frames:
-                frame_data = mobile_frames[token]
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-            else:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + placeholder_frame + b'\r\n')
-            time.sleep(0.1)
+        if session.jpeg is None:
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + placeholder_frame + b'\r\n')
+
+        # Setiap frame HP dikirim tepat sekali; berhenti saat session ditutup
+        last_seq = 0
+        while not session.closed:
+            seq, chunk = session.wait_chunk(last_seq)
+            if chunk is None:
+                continue
+            last_seq = seq
+            with metrics.time("stream_send", camera="mobile"):
+                yield chunk
+            metrics.inc("parking_stream_bytes_total", len(chunk), camera="mobile")
     
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route("/reset_background", methods=["POST"])
 def reset_background():
-    global background_frame
-    cam = get_camera()
-    ret, frame = cam.read()
-    
-    if ret:
-        background_frame = frame.copy()
-        print(f"Background reset! Frame shape: {frame.shape}")
-        return jsonify({
-            "status": "ok",
-            "message": "Background reset berhasil! Sekarang frame ini akan jadi referensi kosong."
-        })
-    else:
+    pipeline = camera_manager.get()
+    if pipeline is None:
         return jsonify({
             "status": "error",
             "message": "Gagal mengambil frame untuk background"
         }), 400
+    return reset_background_response(pipeline)
 
 @app.route("/update_slots", methods=["POST"])
 def update_slots():
-    global slots
-    data = request.get_json()
-    slots = data.get("slots", [])
-    print(f"Updated slots: {len(slots)} slots received")
-    return jsonify({"status": "ok", "slots_count": len(slots)})
+    pipeline = camera_manager.get()
+    if pipeline is None:
+        return camera_not_found(camera_manager.active_id)
+    return update_slots_response(pipeline)
 
-def detect_parking_status(frame):
+class SlotLayout:
     """
-    Deteksi berdasarkan perbedaan dengan background
-    - empty (merah): sama seperti background
-    - occupied (hijau): berbeda dari background
+    Layout slot satu kamera dalam bentuk array, bukan list dict.
+    coords: structured array (x, y, w, h) koordinat asli; bounds hasil clamp
+    per ukuran frame dikompilasi sekali lalu dicache. version naik setiap kali
+    isi layout berubah sehingga cache dan client tahu layout sudah ganti.
     """
-    global background_frame, slots
-    
-    results = {}
-    
-    if frame is None or background_frame is None or len(slots) == 0:
-        for slot in slots:
-            results[slot["id"]] = "empty"
-        return results
 
-    for slot in slots:
-        # Get ROI coordinates with bounds checking
-        x, y, w, h = slot["x"], slot["y"], slot["w"], slot["h"]
-        
-        y1 = max(0, int(y))
-        y2 = min(frame.shape[0], int(y + h))
-        x1 = max(0, int(x))
-        x2 = min(frame.shape[1], int(x + w))
-        
-        if y2 <= y1 or x2 <= x1:
-            results[slot["id"]] = "empty"
-            continue
-            
-        # Extract ROI from current frame and background
-        roi_current = frame[y1:y2, x1:x2]
-        roi_background = background_frame[y1:y2, x1:x2]
-        
-        if roi_current.size == 0 or roi_background.size == 0:
-            results[slot["id"]] = "empty"
-            continue
-        
-        # Calculate difference between current frame and background
-        diff = cv2.absdiff(roi_background, roi_current)
-        diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-        
-        # Apply threshold to get binary image
-        _, thresh = cv2.threshold(diff_gray, 30, 255, cv2.THRESH_BINARY)
-        
-        # Calculate change ratio
-        change_pixels = np.sum(thresh > 0)
-        total_pixels = thresh.size
-        change_ratio = change_pixels / total_pixels if total_pixels > 0 else 0
-        
-        # Determine status based on change ratio
-        threshold = 0.05  # 5% change threshold (lebih sensitif)
-        results[slot["id"]] = "occupied" if change_ratio > threshold else "empty"
-
-    return results
+    COORD_DTYPE = np.dtype([("x", "f8"), ("y", "f8"), ("w", "f8"), ("h", "f8")])
+    BOUNDS_DTYPE = np.dtype([("x1", np.intp), ("y1", np.intp), ("x2", np.intp), ("y2", np.intp),
+                             ("area", np.intp), ("valid", "?")])
 
-@app.route("/video")
-def video():
-    def generate():
-        global camera_lock
-        
-        # Wait if camera is being switched
-        retry = 0
-        while camera_lock and retry < 50:
-            time.sleep(0.1)
-            retry += 1
-
-        cam = get_camera()
-        consecutive_failures = 0
-        max_failures = 30  # Kurangi dari 60 ke 30 untuk reconnect lebih cepat
-        reconnect_attempts = 0
-        max_reconnect = 999
-        frame_skip = 0  # Counter untuk skip frame jika IP camera lambat
-        
-        while True:
-            if cam is None or not cam.isOpened():
-                print(f"Camera disconnected. Reconnect attempt {reconnect_attempts + 1}/{max_reconnect}")
-                time.sleep(2)
-                cam = get_camera()
-                reconnect_attempts += 1
-                consecutive_failures = 0
-                frame_skip = 0
-                continue
-            
-            try:
-                # Untuk IP camera, skip frame jika buffer penuh
-                if camera_url and frame_skip > 0:
-                    cam.grab()  # Skip frame tanpa decode
-                    frame_skip -= 1
-                    continue
-                
-                ret, frame = cam.read()
-                
-                if not ret or frame is None:
-                    consecutive_failures += 1
-                    print(f"Failed to read frame (attempt {consecutive_failures}/{max_failures})")
-                    
-                    if consecutive_failures >= max_failures:
-                        print("Too many failures, releasing camera...")
-                        if cam is not None:
-                            cam.release()
-                        cam = None
-                        consecutive_failures = 0
-                        frame_skip = 0
-                    else:
-                        time.sleep(0.1)
-                    continue
-                
-                # Reset counters jika berhasil
-                consecutive_failures = 0
-                reconnect_attempts = 0
-                
-                # Untuk IP camera, set skip untuk frame berikutnya (reduce lag)
-                if camera_url:
-                    frame_skip = 2  # Skip 2 frame berikutnya
-                
-                # Resize jika frame terlalu besar (untuk IP camera HD)
-                height, width = frame.shape[:2]
-                if width > 1280:
-                    scale = 1280 / width
-                    frame = cv2.resize(frame, None, fx=scale, fy=scale)
-                
-                time.sleep(0.033)  # ~30 FPS
-                    
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-                       
-            except Exception as e:
-                print(f"Error in video stream: {str(e)}")
-                consecutive_failures += 1
-                time.sleep(0.1)
-                   
-    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    def __init__(self, ids=(), coords=None, version=0):
+        self.ids = list(ids)
+        self.coords = np.zeros(0, self.COORD_DTYPE) if coords is None else coords
+        self.version = version
+        self.compiled = {}  # {(shape, scale): structured array BOUNDS_DTYPE}
 
-@app.route("/status")
-def status():
-    cam = get_camera()
-    ret, frame = cam.read()
-    
-    if not ret:
-        # Return empty status if can't read frame
-        return jsonify({slot["id"]: "empty" for slot in slots})
-    
-    # Detect parking status
-    detection_results = detect_parking_status(frame)
-    
-    return jsonify(detection_results)
+    def __len__(self):
+        return len(self.ids)
 
-@app.route("/debug")
-def debug():
-    """Debug endpoint to check system status"""
-    global background_frame, slots, cap
-    
-    cam_opened = cap is not None and cap.isOpened()
-    frame_readable = False
-    frame_shape = None
-    
-    if cam_opened:
-        ret, frame = cap.read()
-        if ret:
-            frame_readable = True
-            frame_shape = frame.shape
-    
-    debug_info = {
-        "background_set": background_frame is not None,
-        "slots_count": len(slots),
-        "camera_opened": cam_opened,
-        "camera_url": camera_url,
-        "webcam_index": DEFAULT_WEBCAM_INDEX,
-        "frame_readable": frame_readable,
-        "frame_shape": frame_shape
-    }
-    
-    return jsonify(debug_info)
+    @classmethod
+    def from_slots(cls, slots, version=0):
+        """Dari list dict {id, x, y, w, h} (format dashboard); field lain diabaikan"""
+        ids = [slot["id"] for slot in slots]
+        coords = np.array([(slot["x"], slot["y"], slot["w"], slot["h"]) for slot in slots],
+                          dtype=cls.COORD_DTYPE)
+        return cls(ids, coords, version)
 
-@app.route("/test_camera", methods=["GET"])
-def test_camera():
-    """Test endpoint untuk cek semua kamera yang tersedia"""
-    available_cameras = []
-    
-    # Test webcam indices 0-5
-    for i in range(6):
-        test_cap = cv2.VideoCapture(i)
-        if test_cap.isOpened():
-            ret, frame = test_cap.read()
-            if ret:
-                available_cameras.append({
-                    "index": i,
-                    "type": "webcam",
-                    "resolution": f"{frame.shape[1]}x{frame.shape[0]}"
-                })
-            test_cap.release()
-    
-    return jsonify({
-        "available_cameras": available_cameras,
-        "total": len(available_cameras)
-    })
+    @classmethod
+    def from_columns(cls, data, version=None):
+        """Format kolom {"ids": [...], "x": [...], ...}: jauh lebih cepat untuk ribuan slot"""
+        ids = list(data.get("ids") or [])
+        coords = np.zeros(len(ids), cls.COORD_DTYPE)
+        for name in cls.COORD_DTYPE.names:
+            coords[name] = np.asarray(data[name], dtype=np.float64).reshape(len(ids))
+        return cls(ids, coords, data.get("version", 0) if version is None else version)
 
-@socketio.on('mobile_frame')
-def handle_mobile_frame(data):
-    """Receive frame from mobile"""
-    token = data.get('token')
-    frame_base64 = data.get('frame')
-    
-    if token in mobile_tokens:
-        # Decode base64 to bytes
-        frame_bytes = base64.b64decode(frame_base64.split(',')[1])
-        mobile_frames[token] = frame_bytes
-        emit('frame_received', {'status': 'ok'})
+    def to_slots(self):
+        return [{"id": slot_id, "x": x, "y": y, "w": w, "h": h}
+                for slot_id, (x, y, w, h) in zip(self.ids, self.coords.tolist())]
 
-@app.route("/set_public_url", methods=["POST"])
-def set_public_url():
-    """Set public URL dari cloudflare tunnel"""
-    global PUBLIC_URL
-    data = request.get_json()
-    url = data.get("url", "").strip()
-    
-    if url:
-        # Pastikan URL tidak berakhir dengan slash
-        PUBLIC_URL = url.rstrip('/')
-        print(f"✓ Public URL set to: {PUBLIC_URL}")
-        return jsonify({"status": "ok", "url": PUBLIC_URL})
+    def to_columns(self):
+        columns = {"version": self.version, "ids": self.ids}
+        for name in self.COORD_DTYPE.names:
+            columns[name] = self.coords[name].tolist()
+        return columns
+
+    def same_slots(self, other):
+        return self.ids == other.ids and np.array_equal(self.coords, other.coords)
+
+    def compile(self, shape, scale=1.0):
+        """Bounds int ter-clamp untuk ukuran frame (dan skala deteksi) ini"""
+        key = (shape[:2], scale)
+        bounds = self.compiled.get(key)
+        if bounds is not None:
+            return bounds
+
+        height, width = shape[:2]
+        x = self.coords["x"] * scale
+        y = self.coords["y"] * scale
+        w = self.coords["w"] * scale
+        h = self.coords["h"] * scale
+
+        # Sama seperti int() per slot: dipotong ke arah nol lalu di-clamp
+        bounds = np.zeros(len(self.ids), self.BOUNDS_DTYPE)
+        bounds["x1"] = np.clip(np.trunc(x), 0, width)
+        bounds["y1"] = np.clip(np.trunc(y), 0, height)
+        bounds["x2"] = np.clip(np.trunc(x + w), 0, width)
+        bounds["y2"] = np.clip(np.trunc(y + h), 0, height)
+        bounds["valid"] = (bounds["x2"] > bounds["x1"]) & (bounds["y2"] > bounds["y1"])
+        bounds["area"] = np.where(bounds["valid"],
+                                  (bounds["x2"] - bounds["x1"]) * (bounds["y2"] - bounds["y1"]), 1)
+        self.compiled[key] = bounds
+        return bounds
+
+def camera_file(directory, camera_id, suffix):
+    """Path file per kamera; camera_id dibersihkan supaya aman jadi nama file"""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(camera_id))
+    return os.path.join(directory, f"{name}{suffix}")
+
+class LayoutStore:
+    """
+    Simpan layout slot per kamera di LAYOUT_DIR/<camera_id>.json (format
+    kolom). Ditulis ke file sementara lalu os.replace supaya file tidak
+    pernah setengah jadi kalau server mati saat menyimpan.
+    """
+
+    def __init__(self, directory=LAYOUT_DIR):
+        self.directory = directory
+
+    def path(self, camera_id):
+        return camera_file(self.directory, camera_id, ".json")
+
+    def load(self, camera_id):
+        try:
+            with open(self.path(camera_id)) as f:
+                return SlotLayout.from_columns(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"✗ Layout {camera_id} rusak, diabaikan: {str(e)}")
+            return None
+
+    def save(self, camera_id, layout):
+        path = self.path(camera_id)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(layout.to_columns(), f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"✗ Gagal menyimpan layout {camera_id}: {str(e)}")
+
+layout_store = LayoutStore()
+
+def to_gray(image, dst=None):
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+class FrameBuffers:
+    """Buffer numpy yang dipakai ulang antar frame; alokasi ulang hanya saat ukuran berubah"""
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+class SlotDetector:
+    """
+    Deteksi semua slot dengan satu diff + threshold per frame.
+    Jumlah pixel berubah per slot diambil O(1) dari integral image,
+    bounds slot diambil dari SlotLayout yang sudah terkompilasi.
+    """
+
+    def __init__(self, pixel_threshold=DETECTION_THRESHOLD, change_threshold=0.05):
+        self.pixel_threshold = pixel_threshold
+        self.change_threshold = change_threshold  # 5% change threshold (lebih sensitif)
+        self.scale = 1.0  # koordinat slot -> koordinat frame yang dideteksi
+        self.layout = SlotLayout()
+        self.compiled = None
+        self.compiled_key = None
+        self.per_roi = False
+        self.buffers = FrameBuffers()
+
+    def set_layout(self, layout):
+        """Ganti layout; bounds diambil ulang saat frame berikutnya"""
+        self.layout = layout
+        self.compiled = None
+
+    def set_slots(self, new_slots):
+        self.set_layout(SlotLayout.from_slots(new_slots))
+
+    def bounds(self, shape):
+        """Bounds slot terkompilasi untuk ukuran frame ini"""
+        key = (shape, self.scale)
+        if self.compiled is None or self.compiled_key != key:
+            b = self.layout.compile(shape, self.scale)
+            valid, area = b["valid"], b["area"]
+            # Layout jarang (slot kecil & sedikit): diff per ROI lebih murah daripada
+            # diff satu frame penuh. Layout padat/overlap: pakai integral image.
+            # Overhead Python per ROI ~ diff 16k pixel, jadi frame kecil cepat memilih integral.
+            pixels = shape[0] * shape[1]
+            self.per_roi = bool(area[valid].sum() < pixels and len(self.layout) * 16000 < pixels)
+            # Kolom dicopy jadi array contiguous agar fancy indexing ke integral tetap cepat
+            self.compiled = (self.layout.ids, b["x1"].copy(), b["y1"].copy(), b["x2"].copy(),
+                             b["y2"].copy(), valid.copy(), area.copy())
+            self.compiled_key = key
+        return self.compiled
+
+    def detect(self, frame, background, subset=None):
+        """
+        Status {id: "empty"/"occupied"}. subset = index slot yang perlu dicek
+        (dari MotionGate); None berarti semua slot.
+        """
+        if len(self.layout) == 0:
+            return {}
+        if frame is None or background is None or background.shape != frame.shape:
+            return dict.fromkeys(self.layout.ids, "empty")
+
+        ids, x1, y1, x2, y2, valid, area = self.bounds(frame.shape)
+
+        if subset is not None or self.per_roi:
+            indices = np.arange(len(ids)) if subset is None else np.asarray(subset, dtype=np.intp)
+            change_pixels = np.zeros(len(indices), dtype=np.int64)
+            for n, i in enumerate(indices.tolist()):
+                if not valid[i]:
+                    continue
+                roi = (slice(y1[i], y2[i]), slice(x1[i], x2[i]))
+                diff_gray = to_gray(cv2.absdiff(background[roi], frame[roi]))
+                _, mask = cv2.threshold(diff_gray, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+                change_pixels[n] = cv2.countNonZero(mask)
+            occupied = valid[indices] & (change_pixels / area[indices] > self.change_threshold)
+            return {ids[i]: ("occupied" if occ else "empty") for i, occ in zip(indices.tolist(), occupied.tolist())}
+
+        # Satu diff + threshold untuk seluruh frame (mask berisi 0/1), semua ke buffer yang dipakai ulang
+        height, width = frame.shape[:2]
+        diff = cv2.absdiff(background, frame, dst=self.buffers.get("diff", frame.shape))
+        diff_gray = to_gray(diff, dst=self.buffers.get("gray", (height, width)))
+        mask = self.buffers.get("mask", (height, width))
+        cv2.threshold(diff_gray, self.pixel_threshold, 1, cv2.THRESH_BINARY, dst=mask)
+        integral = cv2.integral(mask, sum=self.buffers.get("integral", (height + 1, width + 1), np.int32),
+                                sdepth=cv2.CV_32S)
+
+        change_pixels = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        occupied = valid & (change_pixels / area > self.change_threshold)
+
+        return {slot_id: ("occupied" if occ else "empty") for slot_id, occ in zip(ids, occupied.tolist())}
+
+class MotionGate:
+    """
+    Gate murah sebelum deteksi: frame diperkecil (grayscale, 1/8) lalu
+    dibandingkan dengan frame tick sebelumnya. Hanya slot yang area-nya
+    berubah yang dideteksi ulang; slot lain memakai hasil cache. Deteksi
+    penuh tetap dipaksa setiap full_refresh detik.
+    """
+
+    def __init__(self, scale=0.125, pixel_threshold=15, change_threshold=0.02, full_refresh=MOTION_FULL_REFRESH):
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.change_threshold = change_threshold
+        self.full_refresh = full_refresh
+        self.previous = None
+        self.cache = {}
+        self.last_full = 0.0
+        self.counters = {"slots_detected": 0, "slots_skipped": 0,
+                         "full_ticks": 0, "partial_ticks": 0, "static_ticks": 0}
+        self.buffers = FrameBuffers()
+        self.flip = 0  # frame kecil sekarang & sebelumnya bergantian di dua buffer
+        self.detected = None  # index slot yang dideteksi ulang tick terakhir, None = semua
+
+    def reset(self):
+        """Paksa deteksi penuh di tick berikutnya (layout / background berubah)"""
+        self.previous = None
+        self.cache = {}
+
+    def _small(self, frame):
+        height, width = frame.shape[:2]
+        size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        self.flip ^= 1
+        small = self.buffers.get(f"small{self.flip}", (size[1], size[0]))
+        # INTER_LINEAR jauh lebih murah dari INTER_AREA; cukup untuk deteksi gerakan
+        if frame.ndim == 2:
+            return cv2.resize(frame, size, dst=small, interpolation=cv2.INTER_LINEAR)
+        resized = cv2.resize(frame, size, dst=self.buffers.get("resized", small.shape + (3,)),
+                             interpolation=cv2.INTER_LINEAR)
+        return cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY, dst=small)
+
+    def detect(self, detector, frame, background):
+        self.detected = None
+        if frame is None or background is None or len(detector.layout) == 0:
+            self.reset()
+            return detector.detect(frame, background)
+
+        small = self._small(frame)
+        previous, self.previous = self.previous, small
+        ids = detector.bounds(frame.shape)[0]
+        now = time.time()
+
+        if (previous is None or previous.shape != small.shape or now - self.last_full >= self.full_refresh
+                or any(slot_id not in self.cache for slot_id in ids)):
+            self.cache = detector.detect(frame, background)
+            self.last_full = now
+            self.counters["full_ticks"] += 1
+            self.counters["slots_detected"] += len(ids)
+            return dict(self.cache)
+
+        changed = self._changed_slots(detector, frame.shape, small, previous)
+        self.detected = changed
+        if len(changed) == 0:
+            self.counters["static_ticks"] += 1
+        else:
+            self.cache.update(detector.detect(frame, background, subset=changed))
+            self.counters["partial_ticks"] += 1
+        self.counters["slots_detected"] += len(changed)
+        self.counters["slots_skipped"] += len(ids) - len(changed)
+        return {slot_id: self.cache[slot_id] for slot_id in ids}
+
+    def _changed_slots(self, detector, shape, small, previous):
+        """Index slot yang area-nya (di frame kecil) berubah sejak tick sebelumnya"""
+        _, x1, y1, x2, y2, valid, _ = detector.bounds(shape)
+        height, width = small.shape[:2]
+        sx = width / shape[1]
+        sy = height / shape[0]
+
+        # Bulatkan keluar supaya slot kecil tetap punya minimal 1 pixel
+        bx1 = np.clip(np.floor(x1 * sx), 0, width).astype(np.intp)
+        by1 = np.clip(np.floor(y1 * sy), 0, height).astype(np.intp)
+        bx2 = np.clip(np.ceil(x2 * sx), 0, width).astype(np.intp)
+        by2 = np.clip(np.ceil(y2 * sy), 0, height).astype(np.intp)
+        area = np.maximum((bx2 - bx1) * (by2 - by1), 1)
+
+        diff = cv2.absdiff(small, previous, dst=self.buffers.get("diff", small.shape))
+        cv2.threshold(diff, self.pixel_threshold, 1, cv2.THRESH_BINARY, dst=diff)
+        integral = cv2.integral(diff, sum=self.buffers.get("integral", (height + 1, width + 1), np.int32),
+                                sdepth=cv2.CV_32S)
+        moved = integral[by2, bx2] - integral[by1, bx2] - integral[by2, bx1] + integral[by1, bx1]
+        return np.flatnonzero(valid & (moved / area > self.change_threshold))
+
+class BackgroundModel:
+    """
+    Background adaptif: running average (BGR, atau grayscale dengan
+    DETECTION_COLOR=0) di frame yang diperkecil.
+    Tiap tick hanya pixel di slot yang sedang kosong dan berubah sedikit
+    (0 < diff < pixel_threshold) yang di-update, jadi perubahan cahaya pelan
+    terserap tanpa ikut "menelan" mobil yang parkir. Pixel yang juga ditutupi
+    slot terisi (overlap) tidak pernah di-update. Di tick parsial MotionGate
+    hanya kotak di sekitar slot kosong yang berubah yang diproses.
+    """
+
+    def __init__(self, scale=DETECTION_SCALE, alpha=BACKGROUND_ALPHA, color=DETECTION_COLOR):
+        self.scale = scale
+        self.alpha = alpha
+        self.color = color
+        self.model = None  # float32, akumulator running average
+        self.image = None  # uint8, referensi yang dibandingkan dengan frame
+        self.empty_mask = None  # 255 di pixel yang hanya ditutupi slot kosong; dibangun ulang saat status berubah
+        self.empty_key = None
+        self.lock = NativeLock()  # dipakai thread deteksi (run_blocking) dan request reset
+        self.buffers = FrameBuffers()  # hanya dipakai thread deteksi
+        self.frame_shape = None  # ukuran frame kamera terakhir (sebelum diperkecil)
+        self.counters = {"updates": 0, "updated_pixels": 0}
+
+    def ready(self):
+        return self.image is not None
+
+    def size(self, shape):
+        height, width = shape[:2]
+        return max(1, int(width * self.scale)), max(1, int(height * self.scale))
+
+    def prepare(self, frame, reuse=True):
+        """
+        Frame kamera -> BGR / grayscale di resolusi deteksi. Dengan reuse=True
+        hasilnya ada di buffer yang ditimpa frame berikutnya (hot loop tanpa alokasi).
+        """
+        buffers = self.buffers if reuse else FrameBuffers()
+        self.frame_shape = frame.shape[:2]
+        width, height = self.size(frame.shape)
+        # Kecilkan dulu baru cvtColor: konversi warna cukup di pixel yang lebih sedikit.
+        # INTER_AREA cepat untuk rasio tepat 2x, jadi turunkan bertahap per 1/2 lalu
+        # sisa rasionya (< 2x) pakai INTER_LINEAR.
+        step = 0
+        while frame.shape[1] >= 2 * width and frame.shape[0] >= 2 * height:
+            half = (frame.shape[1] // 2, frame.shape[0] // 2)
+            frame = cv2.resize(frame, half, dst=buffers.get(f"half{step}", half[::-1] + frame.shape[2:]),
+                               interpolation=cv2.INTER_AREA)
+            step += 1
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height), dst=buffers.get("resized", (height, width) + frame.shape[2:]),
+                               interpolation=cv2.INTER_LINEAR)
+        if self.color and frame.ndim == 3:
+            small = buffers.get("small", frame.shape)
+            np.copyto(small, frame)  # frame bisa masih frame kamera (skala 1x)
+            return small
+        gray = buffers.get("gray", (height, width))
+        if frame.ndim == 2:
+            np.copyto(gray, frame)
+            return gray
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    def reset(self, frame):
+        """Background baru dari satu frame (seperti /reset_background lama)"""
+        small = self.prepare(frame, reuse=False)
+        with self.lock:
+            self.model = small.astype(np.float32)
+            self.image = small
+
+    def set_scale(self, scale):
+        """Ganti resolusi deteksi; model yang sudah ada ikut di-resize (tidak perlu reset)"""
+        with self.lock:
+            if self.model is not None and scale != self.scale:
+                height, width = self.model.shape[:2]
+                size = (max(1, round(width * scale / self.scale)), max(1, round(height * scale / self.scale)))
+                if self.frame_shape is not None:
+                    self.scale = scale
+                    size = self.size(self.frame_shape)
+                self.model = cv2.resize(self.model, size, interpolation=cv2.INTER_AREA)
+                self.image = cv2.convertScaleAbs(self.model)
+            self.scale = scale
+
+    def clear(self):
+        with self.lock:
+            self.model = None
+            self.image = None
+
+    def _empty_slots(self, detector, shape, results):
+        """(bool per slot kosong, mask pixel yang boleh di-update); mask dibangun ulang hanya saat status berubah"""
+        compiled = detector.bounds(shape)
+        ids, x1, y1, x2, y2, valid, _ = compiled
+        empty = valid & np.fromiter((results.get(slot_id) == "empty" for slot_id in ids), bool, len(ids))
+        key = (compiled, empty.tobytes())
+        if self.empty_key is None or self.empty_key[0] is not compiled or self.empty_key[1] != key[1]:
+            mask = np.zeros(shape[:2], dtype=np.uint8)
+            for i in np.flatnonzero(empty).tolist():
+                mask[y1[i]:y2[i], x1[i]:x2[i]] = 255
+            # Slot terisi ditulis terakhir: pixel overlap ikut slot terisi, bukan slot yang terakhir di layout
+            for i in np.flatnonzero(valid & ~empty).tolist():
+                mask[y1[i]:y2[i], x1[i]:x2[i]] = 0
+            self.empty_mask = mask
+            self.empty_key = key
+        return empty, self.empty_mask
+
+    def update(self, small, detector, results, subset=None):
+        """
+        Serap perubahan kecil di slot kosong; kembalikan jumlah pixel yang di-update.
+        subset = index slot yang dideteksi ulang tick ini (MotionGate.detected);
+        None berarti semua slot (tick penuh).
+        """
+        with self.lock:
+            if self.image is None or small.shape != self.image.shape or len(detector.layout) == 0:
+                return 0
+            empty, empty_mask = self._empty_slots(detector, small.shape, results)
+            if subset is None:
+                indices = np.flatnonzero(empty)
+            else:
+                indices = np.asarray(subset, dtype=np.intp)
+                indices = indices[empty[indices]]
+            self.counters["updates"] += 1
+            if len(indices) == 0:
+                return 0
+
+            # Hanya kotak yang melingkupi slot kosong yang berubah; di dalamnya hanya pixel mask yang ditulis
+            _, x1, y1, x2, y2, _, _ = detector.bounds(small.shape)
+            roi = (slice(int(y1[indices].min()), int(y2[indices].max())),
+                   slice(int(x1[indices].min()), int(x2[indices].max())))
+            region, image, model = small[roi], self.image[roi], self.model[roi]
+            diff = cv2.absdiff(region, image, dst=self.buffers.get("diff", small.shape)[roi])
+            # Sama dengan SlotDetector: threshold di grayscale dari diff
+            diff_gray = to_gray(diff, dst=self.buffers.get("diff_gray", small.shape[:2])[roi])
+            mask = cv2.inRange(diff_gray, 1, detector.pixel_threshold - 1, dst=self.buffers.get("mask", small.shape[:2])[roi])
+            cv2.bitwise_and(mask, empty_mask[roi], dst=mask)
+            changed = cv2.countNonZero(mask)
+            if changed:
+                cv2.accumulateWeighted(region, model, self.alpha, mask=mask)
+                cv2.convertScaleAbs(model, dst=diff)
+                where = mask.view(bool)
+                np.copyto(image, diff, where=where if image.ndim == 2 else where[..., None])
+            self.counters["updated_pixels"] += changed
+            return changed
+
+    def snapshot(self, path):
+        """Simpan model ke .npy (tulis ke file sementara lalu os.replace)"""
+        with self.lock:
+            model = None if self.model is None else self.model.copy()
+        if model is None:
+            return False
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, model)
+            os.replace(f"{path}.tmp", path)
+            return True
+        except OSError as e:
+            print(f"✗ Gagal menyimpan background {path}: {str(e)}")
+            return False
+
+    def restore(self, path):
+        try:
+            model = np.load(path)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"✗ Snapshot background {path} rusak, diabaikan: {str(e)}")
+            return False
+        if model.ndim != (3 if self.color else 2):
+            return False  # snapshot dari mode warna yang lain
+        with self.lock:
+            self.model = model.astype(np.float32)
+            self.image = cv2.convertScaleAbs(self.model)
+        return True
+
+def detect_parking_status(frame, camera_id=None):
+    """
+    Deteksi berdasarkan perbedaan dengan background
+    - empty (merah): sama seperti background
+    - occupied (hijau): berbeda dari background
+    """
+    pipeline = camera_manager.get(camera_id)
+    return pipeline.detect(frame) if pipeline else {}
+
+class StatusLog:
+    """
+    Versi status satu kamera + log perubahan terbatas untuk /status?since= dan
+    ?wait=. Entry (dari_versi, ke_versi, changes, removed); versi boleh lompat
+    (web worker hanya melihat versi yang sempat ia baca dari proses kamera).
+    Request long-poll menunggu di Condition, tidak ada deteksi ulang.
+    """
+
+    def __init__(self, size=STATUS_LOG_SIZE):
+        self.cond = Condition()
+        # Mulai dari waktu (ms) supaya ETag tidak terulang setelah restart / ganti sumber
+        self.version = int(time.time() * 1000)
+        self.entries = deque(maxlen=size)
+
+    def reset(self, version):
+        """Lompat ke version tanpa log; client dengan versi lama dapat status penuh"""
+        with self.cond:
+            self.version = version
+            self.entries.clear()
+            self.cond.notify_all()
+
+    def append(self, changes, removed, version=None):
+        with self.cond:
+            version = self.version + 1 if version is None else version
+            self.entries.append((self.version, version, changes, removed))
+            self.version = version
+            self.cond.notify_all()
+
+    def notify(self):
+        """Bangunkan long-poll tanpa versi baru (mis. layout berubah)"""
+        with self.cond:
+            self.cond.notify_all()
+
+    def wait(self, predicate, timeout):
+        with self.cond:
+            return self.cond.wait_for(predicate, timeout)
+
+    def since(self, version):
+        """
+        (versi sekarang, changes, removed) gabungan setelah version;
+        changes None kalau version sudah keluar dari log (client perlu status penuh)
+        """
+        with self.cond:
+            if version == self.version:
+                return self.version, {}, []
+            merged, removed = {}, set()
+            covered = False
+            for start, end, changes, gone in self.entries:
+                if end <= version:
+                    continue
+                if not covered and start > version:
+                    break
+                covered = True
+                for slot_id in gone:
+                    merged.pop(slot_id, None)
+                    removed.add(slot_id)
+                for slot_id, state in changes.items():
+                    merged[slot_id] = state
+                    removed.discard(slot_id)
+            if not covered:
+                return self.version, None, None
+            return self.version, merged, sorted(removed)
+
+def status_since(log, layout_version, token):
+    """
+    (ETag sekarang, changes, removed) sejak ETag token "<layout>.<status>";
+    changes None kalau token tidak valid, layout sudah berubah, atau terlalu lama
+    """
+    try:
+        token_layout, token_status = (int(part) for part in token.strip('"').split("."))
+    except ValueError:
+        token_layout, token_status = None, None
+    if token_layout != layout_version:
+        return f"{layout_version}.{log.version}", None, None
+    version, changes, removed = log.since(token_status)
+    return f"{layout_version}.{version}", changes, removed
+
+class DetectionLoop:
+    """
+    Jalankan deteksi di server dengan interval tetap dan push hanya slot
+    yang berubah (diff) ke room Socket.IO kamera. /status cukup membaca
+    hasil terakhir yang disimpan di sini.
+    """
+
+    def __init__(self, engine, detect, interval=DETECTION_INTERVAL):
+        self.engine = engine
+        self.detect = detect
+        self.interval = interval
+        self.camera_id = "default"
+        self.results = {}
+        self.last_seq = None
+        self.layout_version = 0
+        self.status_log = StatusLog()
+        self.on_changes = None  # callback(changes), mis. untuk riwayat transisi
+        self.thread = None
+        self.stop_event = Event()
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run, args=(self.stop_event,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def room(self):
+        return f"camera:{self.camera_id}"
+
+    def tick(self):
+        """Satu kali deteksi; kembalikan dict slot yang berubah"""
+        seq, frame = self.engine.latest()
+        if seq == self.last_seq:
+            return {}, []
+        self.last_seq = seq
+
+        with metrics.time("detect", camera=self.camera_id):
+            results = run_blocking(self.detect, frame)
+        previous = self.results
+        changes = {slot_id: state for slot_id, state in results.items() if previous.get(slot_id) != state}
+        removed = [slot_id for slot_id in previous if slot_id not in results]
+        self.results = results
+        return changes, removed
+
+    def invalidate(self):
+        """Paksa deteksi ulang di tick berikutnya (layout / background berubah)"""
+        self.last_seq = None
+
+    def _run(self, stop_event):
+        while not stop_event.wait(self.interval):
+            try:
+                changes, removed = self.tick()
+                if changes and self.on_changes is not None:
+                    self.on_changes(changes)
+                if changes or removed:
+                    self.status_log.append(changes, removed)
+                    socketio.emit('status_diff', {
+                        "camera": self.camera_id,
+                        "changes": changes,
+                        "removed": removed,
+                        "layout_version": self.layout_version
+                    }, to=self.room())
+            except Exception as e:
+                print(f"Error in detection loop: {str(e)}")
+
+class HistoryStore:
+    """
+    Riwayat transisi status slot (bukan snapshot berulang) di SQLite.
+    Satu baris per transisi: (slot_key INTEGER, ts INTEGER ms, occupied 0/1),
+    tabel WITHOUT ROWID dengan primary key (slot_key, ts) sehingga query per
+    slot + rentang waktu cukup satu range scan. Tulis dilakukan batch oleh
+    thread writer, request path hanya put ke queue.
+    """
+
+    def __init__(self, path=HISTORY_DB, batch_size=500, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=100000)
+        self.writer = None
+        self.dropped = 0
+        self.initialized = False
+
+    def _connect(self):
+        # Koneksi writer dipakai bergantian oleh thread pool run_blocking (tidak paralel)
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self.initialized:
+            self._init_db(conn)
+            self.initialized = True
+        return conn
+
+    @staticmethod
+    def _init_db(conn):
+        with conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS slot_keys (
+                               slot_key INTEGER PRIMARY KEY,
+                               camera TEXT NOT NULL,
+                               slot TEXT NOT NULL,
+                               UNIQUE (camera, slot))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS transitions (
+                               slot_key INTEGER NOT NULL,
+                               ts INTEGER NOT NULL,
+                               occupied INTEGER NOT NULL,
+                               PRIMARY KEY (slot_key, ts)) WITHOUT ROWID""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS clips (
+                               slot_key INTEGER NOT NULL,
+                               ts INTEGER NOT NULL,
+                               clip TEXT NOT NULL,
+                               occupied INTEGER NOT NULL,
+                               PRIMARY KEY (slot_key, ts)) WITHOUT ROWID""")
+
+    def record(self, camera_id, changes, timestamp=None):
+        """Non-blocking: transisi masuk queue, writer yang menyimpan"""
+        ts = int((timestamp or time.time()) * 1000)
+        for slot_id, state in changes.items():
+            try:
+                self.queue.put_nowait((camera_id, slot_id, ts, 1 if state == "occupied" else 0))
+            except queue.Full:
+                self.dropped += 1
+        self.start()
+
+    def start(self):
+        if self.writer is not None and self.writer.is_alive():
+            return
+        self.writer = Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def flush(self, timeout=5.0):
+        """Tunggu sampai semua transisi di queue tersimpan"""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _write_loop(self):
+        conn = run_blocking(self._connect)
+        keys = {}        # {(camera, slot): slot_key}
+        last_state = {}  # {slot_key: occupied}, untuk buang "transisi" yang sama
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                run_blocking(self._write_batch, conn, batch, keys, last_state)
+            except Exception as e:
+                print(f"Error writing history: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_batch(self, conn, batch, keys, last_state):
+        rows = []
+        for camera_id, slot_id, ts, occupied in batch:
+            key = keys.get((camera_id, slot_id))
+            if key is None:
+                key = self._slot_key(conn, camera_id, slot_id)
+                keys[(camera_id, slot_id)] = key
+                row = conn.execute("SELECT occupied FROM transitions WHERE slot_key = ? "
+                                   "ORDER BY ts DESC LIMIT 1", (key,)).fetchone()
+                if row is not None:
+                    last_state[key] = row[0]
+            if last_state.get(key) == occupied:
+                continue
+            last_state[key] = occupied
+            rows.append((key, ts, occupied))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO transitions VALUES (?, ?, ?)", rows)
+
+    @staticmethod
+    def _slot_key(conn, camera_id, slot_id):
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO slot_keys (camera, slot) VALUES (?, ?)", (camera_id, slot_id))
+        return conn.execute("SELECT slot_key FROM slot_keys WHERE camera = ? AND slot = ?",
+                            (camera_id, slot_id)).fetchone()[0]
+
+    def _slot_keys(self, conn, camera_id=None, slot_id=None):
+        sql = "SELECT slot_key, camera, slot FROM slot_keys WHERE 1 = 1"
+        params = []
+        if camera_id:
+            sql += " AND camera = ?"
+            params.append(camera_id)
+        if slot_id:
+            sql += " AND slot = ?"
+            params.append(slot_id)
+        return conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _state_at(conn, key, ts):
+        row = conn.execute("SELECT occupied FROM transitions WHERE slot_key = ? AND ts <= ? "
+                           "ORDER BY ts DESC LIMIT 1", (key, ts)).fetchone()
+        return row[0] if row is not None else None
+
+    def query(self, start, end, camera_id=None, slot_id=None, limit=10000):
+        """Transisi dalam [start, end) + status tiap slot tepat di start"""
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        transitions, initial = [], {}
+        with closing(self._connect()) as conn:
+            for key, camera, slot in self._slot_keys(conn, camera_id, slot_id):
+                state = self._state_at(conn, key, start_ms)
+                if state is not None:
+                    initial.setdefault(camera, {})[slot] = "occupied" if state else "empty"
+                for ts, occupied in conn.execute(
+                        "SELECT ts, occupied FROM transitions WHERE slot_key = ? AND ts > ? AND ts < ? "
+                        "ORDER BY ts LIMIT ?", (key, start_ms, end_ms, limit)):
+                    transitions.append({"camera": camera, "slot": slot, "ts": ts / 1000,
+                                        "state": "occupied" if occupied else "empty"})
+        transitions.sort(key=lambda t: t["ts"])
+        return {"initial": initial, "transitions": transitions[:limit]}
+
+    def record_clip(self, camera_id, clip_id, transitions):
+        """Klip per transisi [(slot_id, ts, state)]; dipanggil thread recorder, bukan request"""
+        with closing(self._connect()) as conn:
+            rows = [(self._slot_key(conn, camera_id, slot_id), int(ts * 1000), clip_id,
+                     1 if state == "occupied" else 0)
+                    for slot_id, ts, state in transitions]
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?)", rows)
+
+    def delete_clips(self, camera_id, clip_ids):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM clips WHERE clip = ? AND slot_key IN "
+                             "(SELECT slot_key FROM slot_keys WHERE camera = ?)",
+                             [(clip_id, camera_id) for clip_id in clip_ids])
+
+    def clips(self, start, end, camera_id=None, slot_id=None, limit=1000):
+        """Klip transisi dalam [start, end), terbaru dulu"""
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        clips = []
+        with closing(self._connect()) as conn:
+            for key, camera, slot in self._slot_keys(conn, camera_id, slot_id):
+                for ts, clip_id, occupied in conn.execute(
+                        "SELECT ts, clip, occupied FROM clips WHERE slot_key = ? AND ts >= ? AND ts < ? "
+                        "ORDER BY ts DESC LIMIT ?", (key, start_ms, end_ms, limit)):
+                    clips.append({"camera": camera, "slot": slot, "ts": ts / 1000, "clip": clip_id,
+                                  "state": "occupied" if occupied else "empty"})
+        clips.sort(key=lambda clip: clip["ts"], reverse=True)
+        return clips[:limit]
+
+    def utilization(self, start, end, camera_id=None, slot_id=None):
+        """Lama terisi & rasio utilisasi per slot dalam [start, end)"""
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        span = max(end_ms - start_ms, 1)
+        result = {}
+        with closing(self._connect()) as conn:
+            for key, camera, slot in self._slot_keys(conn, camera_id, slot_id):
+                state = self._state_at(conn, key, start_ms) or 0
+                since = start_ms
+                occupied_ms = 0
+                rows = conn.execute("SELECT ts, occupied FROM transitions WHERE slot_key = ? AND ts > ? AND ts < ? "
+                                    "ORDER BY ts", (key, start_ms, end_ms)).fetchall()
+                for ts, occupied in rows:
+                    if state:
+                        occupied_ms += ts - since
+                    state, since = occupied, ts
+                if state:
+                    occupied_ms += end_ms - since
+                result.setdefault(camera, {})[slot] = {
+                    "occupied_seconds": occupied_ms / 1000,
+                    "utilization": round(occupied_ms / span, 4),
+                    "transitions": len(rows)
+                }
+        return result
+
+history_store = HistoryStore()
+
+class RecordingRing:
+    """
+    Ring JPEG di file memory-mapped (CLIP_DIR/<camera>.ring) berukuran tetap.
+    Isi file: magic, header int64 [kapasitas index, ukuran data, seq berikut,
+    seq tertua, head data], index (ts us, offset, panjang) per frame, lalu area
+    data. Frame tidak pernah dipotong di ujung area: kalau tidak muat ditulis
+    dari offset 0, dan frame lama yang tertimpa dibuang dari index. Hanya
+    dipakai thread recorder kamera itu, jadi tanpa lock.
+    """
+
+    MAGIC = b"PKRING01"
+    INDEX_DTYPE = np.dtype([("ts", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+
+    def __init__(self, path, size=RECORDING_RING_BYTES, frames=RECORDING_RING_FRAMES):
+        header_bytes = len(self.MAGIC) + 5 * 8
+        self.data_offset = header_bytes + frames * self.INDEX_DTYPE.itemsize
+        total = self.data_offset + size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            resized = os.fstat(fd).st_size != total
+            if resized:
+                os.ftruncate(fd, total)
+            self.mm = mmap.mmap(fd, total)
+        finally:
+            os.close(fd)
+        self.header = np.ndarray((5,), "<i8", self.mm, len(self.MAGIC))
+        self.index = np.ndarray((frames,), self.INDEX_DTYPE, self.mm, header_bytes)
+        # Ring dari run sebelumnya dipakai lagi kalau formatnya sama
+        if resized or self.mm[:len(self.MAGIC)] != self.MAGIC or tuple(self.header[:2]) != (frames, size):
+            self.mm[:len(self.MAGIC)] = self.MAGIC
+            self.header[:] = (frames, size, 0, 0, 0)
+
+    def close(self):
+        self.header = self.index = None
+        self.mm.close()
+
+    def __len__(self):
+        return int(self.header[2] - self.header[3])
+
+    def append(self, jpeg, timestamp):
+        frames, size, seq, tail, head = (int(value) for value in self.header)
+        length = len(jpeg)
+        if length > size // 4:
+            return False
+        wrap = head + length > size
+        offset = 0 if wrap else head
+        while tail < seq:
+            entry = self.index[tail % frames]
+            start = int(entry["offset"])
+            end = start + int(entry["length"])
+            # Slot index dipakai ulang, sisa di ujung area (lebih tua dari yang
+            # akan ditimpa), atau area datanya memang tertimpa
+            if not (seq - tail >= frames or (wrap and start >= head) or (start < offset + length and offset < end)):
+                break
+            tail += 1
+        self.mm[self.data_offset + offset:self.data_offset + offset + length] = jpeg
+        self.index[seq % frames] = (int(timestamp * 1e6), offset, length)
+        self.header[2:] = (seq + 1, tail, offset + length)
+        return True
+
+    def frames_between(self, start, end):
+        """[(timestamp, bytes JPEG)] yang masih ada di ring dalam [start, end]"""
+        frames, size, seq, tail, head = (int(value) for value in self.header)
+        entries = self.index[np.arange(tail, seq) % frames]
+        timestamps = entries["ts"] / 1e6
+        result = []
+        for ts, offset, length in entries[(timestamps >= start) & (timestamps <= end)].tolist():
+            base = self.data_offset + offset
+            result.append((ts / 1e6, self.mm[base:base + length]))
+        return result
+
+class ClipRecorder:
+    """
+    Rekam frame kamera (JPEG kecil, RECORD_FPS) ke RecordingRing dan simpan
+    klip di sekitar transisi slot tanpa encode ulang: CLIP_BEFORE detik sebelum
+    sampai CLIP_AFTER detik sesudah, transisi berdekatan digabung jadi satu
+    klip. Semua kerja di thread recorder; detection loop hanya menaruh event
+    ke queue, dan stream live tidak pernah menunggu recorder. Kamera HP
+    merekam JPEG asli dari HP, jadi frame HP tetap tidak di-decode.
+    """
+
+    def __init__(self, camera_id, broadcaster, engine):
+        self.camera_id = camera_id
+        self.broadcaster = broadcaster
+        self.engine = engine
+        self.directory = camera_file(CLIP_DIR, camera_id, "")
+        self.ring_path = camera_file(CLIP_DIR, camera_id, ".ring")
+        self.events = queue.Queue(maxsize=1000)
+        self.pending = []  # klip yang menunggu CLIP_AFTER detik selesai direkam
+        self.last_state = {}  # {slot_id: state}, transisi = state berbeda dari sebelumnya
+        self.counters = {"frames": 0, "clips": 0, "pruned": 0, "dropped_events": 0}
+        self.thread = None
+        self.stop_event = Event()
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run, args=(self.stop_event,), daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+
+    def trigger(self, changes, timestamp=None):
+        """Dipanggil detection loop: O(jumlah slot berubah), export di thread recorder"""
+        timestamp = timestamp or time.time()
+        transitions = []
+        for slot_id, state in changes.items():
+            previous = self.last_state.get(slot_id)
+            self.last_state[slot_id] = state
+            # Tick pertama (previous None) bukan transisi
+            if previous is not None and previous != state:
+                transitions.append((slot_id, timestamp, state))
+        if transitions:
+            try:
+                self.events.put_nowait(transitions)
+            except queue.Full:
+                self.counters["dropped_events"] += 1
+
+    def _run(self, stop_event):
+        try:
+            ring = run_blocking(RecordingRing, self.ring_path)
+        except OSError as e:
+            print(f"✗ Recording {self.camera_id} dimatikan: {str(e)}")
+            return
+        interval = 1.0 / RECORD_FPS
+        last_seq = 0
+        try:
+            while not stop_event.is_set():
+                started = time.time()
+                seq, chunk = self._next_chunk(last_seq)
+                if chunk is not None:
+                    last_seq = seq
+                    captured = self.engine.timestamp if self.engine.seq == seq else started
+                    # Simpan JPEG-nya saja, tanpa header multipart
+                    jpeg = memoryview(chunk)[chunk.index(b'\r\n\r\n') + 4:-2]
+                    if ring.append(jpeg, captured):
+                        self.counters["frames"] += 1
+                self._collect()
+                while self.pending and self.pending[0]["end"] <= time.time():
+                    event = self.pending.pop(0)
+                    try:
+                        run_blocking(self._export, ring, event)
+                    except Exception as e:
+                        print(f"✗ Gagal menyimpan klip {self.camera_id}: {str(e)}")
+                stop_event.wait(max(0.0, interval - (time.time() - started)))
+        finally:
+            ring.close()
+
+    def _next_chunk(self, last_seq):
+        if isinstance(self.engine, MobileFrameSource):
+            # Chunk /mobile_video yang sama (JPEG dari HP), tanpa decode + encode ulang
+            return self.engine.wait_chunk(last_seq)
+        return self.broadcaster.next_chunk(last_seq, RECORD_QUALITY, RECORD_MAX_WIDTH)
+
+    def _collect(self):
+        """Event transisi dari queue -> klip pending, digabung kalau berdekatan"""
+        while True:
+            try:
+                transitions = self.events.get_nowait()
+            except queue.Empty:
+                return
+            timestamp = transitions[0][1]
+            last = self.pending[-1] if self.pending else None
+            if (last is not None and timestamp - CLIP_BEFORE <= last["end"]
+                    and timestamp + CLIP_AFTER - last["start"] <= CLIP_MAX_SECONDS):
+                last["end"] = timestamp + CLIP_AFTER
+                last["transitions"].extend(transitions)
+            else:
+                self.pending.append({"ts": timestamp, "start": timestamp - CLIP_BEFORE,
+                                     "end": timestamp + CLIP_AFTER, "transitions": transitions})
+
+    def _export(self, ring, event):
+        """Salin frame dari ring apa adanya ke <clip>.mjpeg + index <clip>.json"""
+        frames = ring.frames_between(event["start"], event["end"])
+        if not frames:
+            return
+        clip_id = str(int(event["ts"] * 1000))
+        base = os.path.join(self.directory, clip_id)
+        os.makedirs(self.directory, exist_ok=True)
+        index, offset = [], 0
+        with open(f"{base}.mjpeg.tmp", "wb") as f:
+            for ts, jpeg in frames:
+                f.write(jpeg)
+                index.append([round(ts, 3), offset, len(jpeg)])
+                offset += len(jpeg)
+        os.replace(f"{base}.mjpeg.tmp", f"{base}.mjpeg")
+        meta = {
+            "id": clip_id,
+            "camera": self.camera_id,
+            "ts": event["ts"],
+            "start": index[0][0],
+            "end": index[-1][0],
+            "bytes": offset,
+            "transitions": [{"slot": slot_id, "ts": ts, "state": state}
+                            for slot_id, ts, state in event["transitions"]],
+            "frames": index
+        }
+        with open(f"{base}.json.tmp", "w") as f:
+            json.dump(meta, f, separators=(",", ":"))
+        os.replace(f"{base}.json.tmp", f"{base}.json")
+        history_store.record_clip(self.camera_id, clip_id, event["transitions"])
+        self.counters["clips"] += 1
+        self._prune()
+
+    def _prune(self):
+        """Hapus klip tertua sampai total klip kamera ini <= CLIP_MAX_BYTES"""
+        clips = []
+        for path in glob.glob(os.path.join(self.directory, "*.mjpeg")):
+            try:
+                clips.append((int(os.path.basename(path)[:-len(".mjpeg")]), os.path.getsize(path)))
+            except (ValueError, OSError):
+                continue
+        clips.sort()
+        total = sum(size for _, size in clips)
+        removed = []
+        for clip_id, size in clips:
+            if total <= CLIP_MAX_BYTES:
+                break
+            for suffix in (".json", ".mjpeg"):
+                try:
+                    os.remove(os.path.join(self.directory, f"{clip_id}{suffix}"))
+                except OSError:
+                    pass
+            total -= size
+            removed.append(str(clip_id))
+        if removed:
+            history_store.delete_clips(self.camera_id, removed)
+            self.counters["pruned"] += len(removed)
+
+class CameraPipeline:
+    """
+    Satu kamera = capture thread, broadcaster MJPEG, background, layout slot
+    dan detection loop sendiri. OpenCV melepas GIL saat decode/diff/encode,
+    jadi thread tiap kamera berjalan paralel di core yang berbeda.
+    """
+
+    def __init__(self, camera_id, url=None, index=DEFAULT_WEBCAM_INDEX, token=None):
+        self.camera_id = camera_id
+        self.url = url or None
+        self.index = index
+        self.token = token
+        self.cap = None
+        self.layout = SlotLayout()
+        self.detector = SlotDetector()
+        self.gate = MotionGate()
+
+        self.background = BackgroundModel()
+        self.gate_scale = self.gate.scale
+
+        if token:  # mobile camera: frame datang dari Socket.IO, bukan cv2.VideoCapture
+            self.engine = mobile_sessions.get(token) or MobileFrameSource(token)
+        else:
+            self.engine = CaptureEngine(self.open)
+            self.engine.ip_camera = bool(self.url) and not is_replay_url(self.url)
+
+        self.broadcaster = MjpegBroadcaster(self.engine)
+        self.broadcaster.name = camera_id
+        if not token:
+            self.engine.name = camera_id
+        self.loop = DetectionLoop(self.engine, self.detect,
+                                  MOBILE_DETECTION_INTERVAL if token else DETECTION_INTERVAL)
+        self.loop.camera_id = camera_id
+        self.loop.on_changes = self.record_changes
+        self.recorder = ClipRecorder(camera_id, self.broadcaster, self.engine) if RECORD_FPS > 0 else None
+        self.set_detection_scale(DETECTION_SCALE)
+
+        layout = layout_store.load(camera_id)
+        if layout is not None:
+            self.apply_layout(layout)
+
+        # Background terakhir dipulihkan supaya restart tidak perlu reset manual
+        self.snapshot_path = camera_file(BACKGROUND_DIR, camera_id, ".npy")
+        self.last_snapshot = time.time()
+        if self.background.restore(self.snapshot_path):
+            print(f"✓ Background {camera_id} restored from {self.snapshot_path}")
+
+    def set_detection_scale(self, scale):
+        """
+        Skala deteksi relatif ke resolusi kamera asli. Frame HP sudah di-decode
+        1/2, jadi background cukup diperkecil sisanya. Koordinat slot dipetakan
+        otomatis lewat detector.scale; stream video tetap resolusi penuh.
+        """
+        scale = min(1.0, max(0.05, float(scale)))
+        source_scale = getattr(self.engine, "scale", 1.0)
+        self.detection_scale = scale
+        self.background.set_scale(min(1.0, scale / source_scale))
+        self.detector.scale = source_scale * self.background.scale
+        # Motion gate tetap bekerja di ~1/8 resolusi kamera
+        self.gate.scale = min(1.0, self.gate_scale / self.detector.scale)
+        self.gate.reset()
+        self.loop.invalidate()
+
+    def record_changes(self, changes):
+        # Tanpa background semua slot "empty"; itu bukan transisi sungguhan
+        if self.background.ready():
+            history_store.record(self.camera_id, changes)
+            if self.recorder is not None:
+                self.recorder.trigger(changes)
+
+    def source(self):
+        if self.token:
+            return f"mobile {self.token}"
+        return self.url or f"webcam {self.index}"
+
+    def same_source(self, url=None, index=DEFAULT_WEBCAM_INDEX, token=None):
+        if token or self.token:
+            return token == self.token
+        return self.url == (url or None) and (url or self.index == index)
+
+    def open(self):
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = get_camera(self.url, self.index)
+        return self.cap
+
+    def start(self):
+        self.engine.start()
+        self.loop.start()
+        if self.recorder is not None:
+            self.recorder.start()
+
+    def stop(self):
+        self.loop.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        self.engine.stop()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        self.snapshot_background()
+
+    def discard_background(self):
+        self.background.clear()
+        try:
+            os.remove(self.snapshot_path)
+        except OSError:
+            pass
+
+    def snapshot_background(self):
+        self.last_snapshot = time.time()
+        if self.snapshot_path:
+            self.background.snapshot(self.snapshot_path)
+
+    def wait_frame(self, timeout=10.0):
+        """Frame terbaru, tunggu dulu kalau kamera belum publish apa-apa"""
+        seq, frame = self.engine.latest()
+        if frame is None:
+            seq, frame = self.engine.wait_frame(seq, timeout)
+        return frame
+
+    def detect(self, frame):
+        if frame is None:
+            return self.gate.detect(self.detector, None, None)
+        small = self.background.prepare(frame)
+        background = self.background.image
+        if background is not None and background.shape != small.shape:
+            # Resolusi kamera berubah sejak snapshot: background lama tidak bisa dipakai
+            print(f"✗ Background {self.camera_id} {background.shape} != frame {small.shape}, dibuang")
+            self.background.clear()
+            background = None
+
+        results = self.gate.detect(self.detector, small, background)
+        if background is not None:
+            with metrics.time("background", camera=self.camera_id):
+                self.background.update(small, self.detector, results, self.gate.detected)
+            if time.time() - self.last_snapshot >= BACKGROUND_SNAPSHOT_INTERVAL:
+                self.snapshot_background()
+        return results
+
+    def apply_layout(self, layout):
+        """Pakai layout tanpa menyimpan ke disk"""
+        self.layout = layout
+        self.detector.set_layout(layout)
+        self.loop.layout_version = layout.version
+        self.loop.status_log.notify()
+        self.gate.reset()
+        self.loop.invalidate()
+
+    def set_layout(self, layout):
+        """Ganti layout + simpan; version hanya naik kalau isinya berubah"""
+        if layout.same_slots(self.layout):
+            return False
+        layout.version = self.layout.version + 1
+        self.apply_layout(layout)
+        layout_store.save(self.camera_id, layout)
+        return True
+
+    def set_slots(self, new_slots):
+        return self.set_layout(SlotLayout.from_slots(new_slots))
+
+    def reset_background(self):
+        frame = self.wait_frame(timeout=3.0)
+        if frame is not None:
+            self.background.reset(frame)
+            self.snapshot_background()
+            self.gate.reset()
+            self.loop.invalidate()
+        return frame
+
+    def status(self):
+        # Slot yang belum sempat dideteksi dianggap kosong; slot yang sudah dihapus
+        # dari layout tidak ikut walaupun detection loop belum sempat tick
+        results = self.loop.results
+        return {slot_id: results.get(slot_id, "empty") for slot_id in self.layout.ids}
+
+    def status_version(self):
+        """ETag status: "<versi layout>.<versi status>", berubah di setiap diff"""
+        return f"{self.layout.version}.{self.loop.status_log.version}"
+
+    def status_since(self, token):
+        return status_since(self.loop.status_log, self.layout.version, token)
+
+    def wait_status(self, token, timeout):
+        return self.loop.status_log.wait(lambda: self.status_version() != token, timeout)
+
+    def debug_info(self):
+        seq, frame = self.engine.latest()
+        return {
+            "camera_id": self.camera_id,
+            "status_version": self.loop.status_log.version,
+            "background_set": self.background.ready(),
+            "background_model": dict(self.background.counters, scale=self.background.scale),
+            "detection_scale": self.detection_scale,
+            "detection_color": self.background.color,
+            "slots_count": len(self.layout),
+            "layout_version": self.layout.version,
+            "camera_opened": (self.token in mobile_sessions) if self.token else
+                             self.cap is not None and self.cap.isOpened(),
+            "camera_url": self.url,
+            "webcam_index": self.index,
+            "frame_readable": frame is not None and time.time() - self.engine.timestamp < 2.0,
+            "frame_shape": frame.shape if frame is not None else None,
+            "frame_seq": seq,
+            "frame_age": round(time.time() - self.engine.timestamp, 3) if frame is not None else None,
+            "motion_gate": dict(self.gate.counters),
+            "recorder": dict(self.recorder.counters) if self.recorder is not None else None,
+            "capture": None if self.token else {
+                "decode_ms": round(self.engine.decode_ema * 1000, 2),
+                "source_fps": round(1.0 / self.engine.frame_interval, 1),
+                "dropped": self.engine.dropped
+            }
+        }
+
+class CameraManager:
+    """Registry semua kamera aktif: {camera_id: CameraPipeline}"""
+
+    supports_mobile = True
+
+    def __init__(self):
+        self.lock = Lock()
+        self.cameras = {}
+        self.active_id = None  # kamera untuk route lama (/video, /status, ...)
+
+    def get(self, camera_id=None):
+        with self.lock:
+            return self.cameras.get(camera_id or self.active_id)
+
+    def add(self, camera_id, url=None, index=DEFAULT_WEBCAM_INDEX, token=None):
+        """Daftarkan / ganti sumber kamera; pipeline lain tidak disentuh"""
+        existing = self.get(camera_id)
+        if existing is not None and existing.same_source(url, index, token):
+            return existing
+        # Dibangun di luar lock: load layout + background dari disk tidak menahan get() request lain
+        pipeline = CameraPipeline(camera_id, url, index, token)
+        with self.lock:
+            existing = self.cameras.get(camera_id)
+            if existing is not None and existing.same_source(url, index, token):
+                return existing  # request lain mendaftarkan sumber yang sama duluan
+            if existing is not None:
+                # Layout slot tetap dipakai walaupun sumber kamera berubah
+                pipeline.apply_layout(existing.layout)
+                existing.snapshot_path = None
+            self.cameras[camera_id] = pipeline
+
+        if existing is not None:
+            # ...tapi background sumber lama tidak berlaku untuk sumber baru
+            pipeline.discard_background()
+            existing.stop()
+        pipeline.start()
+        return pipeline
+
+    def remove(self, camera_id):
+        with self.lock:
+            pipeline = self.cameras.pop(camera_id, None)
+            if self.active_id == camera_id:
+                self.active_id = None
+        if pipeline is not None:
+            pipeline.stop()
+        return pipeline is not None
+
+    def all(self):
+        with self.lock:
+            return list(self.cameras.values())
+
+camera_manager = CameraManager()
+
+class SharedRing:
+    """
+    Ring buffer di multiprocessing.shared_memory: satu writer (proses kamera),
+    banyak reader (web worker). Header int64 [seq terakhir, jumlah slot,
+    kapasitas slot, waktu terakhir ada viewer (us)], per slot [seq, panjang,
+    timestamp us] lalu data. Tanpa lock antar proses: writer menandai slot
+    dengan seq -1 selama menulis, reader cek seq slot sebelum dan sesudah
+    menyalin (seqlock) dan mengulang kalau slot tertimpa.
+    """
+
+    HEADER = 4
+    SLOT_HEADER = 3
+
+    def __init__(self, name, slots=FRAME_RING_SLOTS, slot_bytes=FRAME_RING_SLOT_BYTES, create=False):
+        self.name = name
+        self.owner = create
+        if create:
+            size = (self.HEADER + slots * self.SLOT_HEADER) * 8 + slots * slot_bytes
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Python < 3.13 ikut mendaftarkan segment yang hanya di-attach ke resource
+            # tracker, yang lalu meng-unlink-nya saat reader exit. Pemiliknya proses kamera.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.header = np.ndarray((self.HEADER,), np.int64, self.shm.buf)
+        if create:
+            self.header[:] = (0, slots, slot_bytes, 0)
+        self.slots, self.slot_bytes = int(self.header[1]), int(self.header[2])
+        self.meta = np.ndarray((self.slots, self.SLOT_HEADER), np.int64, self.shm.buf, self.HEADER * 8)
+        offset = (self.HEADER + self.slots * self.SLOT_HEADER) * 8
+        self.data = np.ndarray((self.slots, self.slot_bytes), np.uint8, self.shm.buf, offset)
+
+    def close(self):
+        # View numpy dilepas dulu, SharedMemory.close() menolak kalau buffer masih di-export
+        self.header = self.meta = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def seq(self):
+        return int(self.header[0])
+
+    def write(self, payload, timestamp=None):
+        """Tulis bytes ke slot berikutnya; False kalau lebih besar dari kapasitas slot"""
+        size = len(payload)
+        if size > self.slot_bytes:
+            return False
+        seq = int(self.header[0]) + 1
+        index = seq % self.slots
+        meta = self.meta[index]
+        meta[0] = -1
+        self.data[index, :size] = np.frombuffer(payload, np.uint8)
+        meta[1] = size
+        meta[2] = int((timestamp or time.time()) * 1e6)
+        meta[0] = seq
+        self.header[0] = seq
+        return True
+
+    def read(self):
+        """(seq, timestamp, bytes) terbaru, atau (0, 0.0, None) kalau belum ada"""
+        for _ in range(self.slots):
+            seq = int(self.header[0])
+            if seq == 0:
+                break
+            index = seq % self.slots
+            meta = self.meta[index]
+            if meta[0] != seq:
+                continue
+            size, timestamp = int(meta[1]), meta[2] / 1e6
+            payload = self.data[index, :size].tobytes()
+            if meta[0] == seq:
+                return seq, timestamp, payload
+        return 0, 0.0, None
+
+    def touch(self):
+        """Reader menandai masih ada viewer; writer boleh berhenti encode kalau tidak ada"""
+        self.header[3] = int(time.time() * 1e6)
+
+    def demand(self):
+        return time.time() - self.header[3] / 1e6 < RING_DEMAND_TIMEOUT
+
+def unlink_shared_memory(name):
+    """Bersihkan segment milik proses kamera yang mati tanpa sempat unlink"""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+class CameraWorker:
+    """
+    Isi proses kamera di mode multi-proses: CameraPipeline biasa ditambah
+    publisher yang menulis chunk MJPEG dan state (status + debug) ke
+    SharedRing, dan handler perintah dari supervisor.
+    """
+
+    def __init__(self, config):
+        self.camera_id = config["id"]
+        self.pipeline = CameraPipeline(self.camera_id, config.get("url"),
+                                       config.get("index", DEFAULT_WEBCAM_INDEX))
+        if config.get("discard_background"):
+            self.pipeline.discard_background()
+        self.frames = SharedRing(config["frame_ring"], create=True)
+        self.states = SharedRing(config["state_ring"], STATE_RING_SLOTS, STATE_RING_SLOT_BYTES, create=True)
+        self.state_lock = Lock()  # ring state punya satu writer: publisher atau handler perintah
+        self.stop_event = Event()
+        self.threads = []
+        self.overflow = False
+
+    def start(self):
+        self.pipeline.start()
+        self.publish_state()
+        for target in (self._publish_frames, self._publish_states):
+            thread = Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, snapshot=True):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        if not snapshot:
+            self.pipeline.snapshot_path = None
+        self.pipeline.stop()
+        for thread in self.threads:
+            thread.join(2.0)
+
+    def close(self):
+        self.frames.close()
+        self.states.close()
+
+    def publish_state(self):
+        pipeline = self.pipeline
+        state = json.dumps({
+            "status": pipeline.status(),
+            "layout_version": pipeline.layout.version,
+            "status_version": pipeline.loop.status_log.version,
+            "debug": pipeline.debug_info()
+        }, default=float).encode()
+        with self.state_lock:
+            if not self.states.write(state):
+                print(f"✗ State {self.camera_id} {len(state)} bytes > STATE_RING_SLOT_BYTES")
+
+    def _publish_frames(self):
+        """Chunk MJPEG ke ring, tapi hanya selama ada viewer di salah satu web worker"""
+        broadcaster, engine = self.pipeline.broadcaster, self.pipeline.engine
+        last_seq = 0
+        while not self.stop_event.is_set():
+            if not self.frames.demand():
+                self.stop_event.wait(0.05)
+                continue
+            seq, chunk = broadcaster.next_chunk(last_seq)
+            if chunk is None:
+                continue
+            last_seq = seq
+            written = self.frames.write(chunk, engine.timestamp if engine.seq == seq else None)
+            if not written and not self.overflow:
+                print(f"✗ Frame {self.camera_id} {len(chunk)} bytes > FRAME_RING_SLOT_BYTES, dilewati")
+            self.overflow = not written
+
+    def _publish_states(self):
+        """State baru setiap hasil deteksi berubah, minimal sekali per detik untuk /debug"""
+        last_results, last_version, last_time = None, None, 0.0
+        while not self.stop_event.wait(min(DETECTION_INTERVAL, 0.1)):
+            results, version = self.pipeline.loop.results, self.pipeline.status_version()
+            if results is last_results and version == last_version and time.time() - last_time < 1.0:
+                continue
+            last_results, last_version, last_time = results, version, time.time()
+            try:
+                self.publish_state()
+            except Exception as e:
+                print(f"Error publishing state: {str(e)}")
+
+    def handle(self, message):
+        cmd, args = message.get("cmd"), message.get("args") or {}
+        pipeline = self.pipeline
+        if cmd == "layout":
+            return pipeline.layout.to_columns()
+        if cmd == "stop":
+            self.stop(args.get("snapshot", True))
+            return {"status": "ok"}
+        if cmd == "set_slots":
+            changed = pipeline.set_slots(args.get("slots") or [])
+        elif cmd == "set_layout":
+            changed = pipeline.set_layout(SlotLayout.from_columns(args["layout"], version=0))
+        elif cmd == "set_detection_scale":
+            pipeline.set_detection_scale(args["scale"])
+            changed = True
+        elif cmd == "reset_background":
+            changed = pipeline.reset_background() is not None
+        else:
+            return {"status": "error", "message": f"Unknown command {cmd}"}
+        self.publish_state()
+        return {"status": "ok", "changed": changed, "layout_version": pipeline.layout.version}
+
+    def serve(self, conn):
+        """Perintah dari supervisor sampai stop, atau sampai supervisor hilang"""
+        while not self.stop_event.is_set():
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                reply = self.handle(message)
+            except Exception as e:
+                reply = {"status": "error", "message": str(e)}
+            conn.send(reply)
+
+class CameraProcess:
+    """Satu proses kamera dilihat dari supervisor: subprocess + koneksi perintahnya"""
+
+    def __init__(self, config):
+        self.config = config
+        self.process = None
+        self.conn = None
+        self.ready = Event()
+        self.lock = Lock()  # satu perintah sekaligus per koneksi
+
+    def info(self):
+        return {key: self.config[key] for key in ("id", "source", "generation", "frame_ring", "state_ring")}
+
+    def same_source(self, url=None, index=DEFAULT_WEBCAM_INDEX):
+        return self.config["url"] == (url or None) and (url or self.config["index"] == index)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, env):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--camera-worker",
+                                         json.dumps(self.config)], env=dict(env, PARKING_ROLE="camera"))
+
+    def request(self, message):
+        with self.lock:
+            if self.conn is None:
+                return {"status": "error", "message": f"Camera process {self.config['id']} not running"}
+            try:
+                self.conn.send(message)
+                return self.conn.recv()
+            except (EOFError, OSError):
+                self.conn = None
+                return {"status": "error", "message": f"Camera process {self.config['id']} exited"}
+
+    def stop(self, snapshot=True, timeout=10.0):
+        self.request({"cmd": "stop", "args": {"snapshot": snapshot}})
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        for name in (self.config["frame_ring"], self.config["state_ring"]):
+            unlink_shared_memory(name)
+
+class CameraSupervisor:
+    """
+    Proses induk mode multi-proses. Memegang registry kamera, menjalankan satu
+    proses kamera per kamera (python app.py --camera-worker) dan melayani bus
+    perintah dari web worker. Frame dan status tidak lewat sini: web worker
+    membacanya langsung dari SharedRing milik proses kamera.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.spawn_lock = Lock()  # add / remove / restart kamera berurutan
+        self.cameras = {}  # {camera_id: CameraProcess}
+        self.active_id = None
+        self.generation = 0
+        # Socket Unix di direktori 0700: hanya user yang sama yang bisa kirim perintah
+        self.bus_dir = tempfile.mkdtemp(prefix="parking-bus-")
+        self.bus_path = os.path.join(self.bus_dir, "bus.sock")
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.bus_path)
+        self.listener.listen(128)
+        self.stop_event = Event()
+
+    def env(self):
+        """Environment untuk proses anak supaya bisa connect balik ke bus"""
+        return dict(os.environ, PARKING_BUS=self.bus_path)
+
+    def serve(self):
+        """Terima koneksi bus sampai stop(); tiap koneksi dilayani thread sendiri"""
+        Thread(target=self._watchdog, daemon=True).start()
+        while not self.stop_event.is_set():
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                break
+            Thread(target=self._serve_conn, args=(BusConnection(sock),), daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+        for camera in self.all():
+            camera.stop()
+        self.listener.close()
+        shutil.rmtree(self.bus_dir, ignore_errors=True)
+
+    def all(self):
+        with self.lock:
+            return list(self.cameras.values())
+
+    def _serve_conn(self, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                return
+            if message.get("op") == "camera_hello":
+                # Koneksi ini selanjutnya dipakai supervisor untuk kirim perintah ke kamera
+                self._attach(message, conn)
+                return
+            try:
+                reply = self.handle(message)
+            except Exception as e:
+                reply = {"status": "error", "message": str(e)}
+            conn.send(reply)
+
+    def _attach(self, message, conn):
+        with self.lock:
+            camera = self.cameras.get(message.get("id"))
+        if camera is None or camera.config["generation"] != message.get("generation"):
+            conn.close()
+            return
+        camera.conn = conn
+        camera.ready.set()
+
+    def handle(self, message):
+        op = message.get("op")
+        if op == "list":
+            with self.lock:
+                return {"active": self.active_id,
+                        "cameras": {camera_id: camera.info() for camera_id, camera in self.cameras.items()
+                                    if camera.ready.is_set()}}
+        if op == "set_active":
+            self.active_id = message.get("id")
+            return {"status": "ok"}
+        if op == "add":
+            return self.add(message["id"], message.get("url"), message.get("index", DEFAULT_WEBCAM_INDEX))
+        if op == "remove":
+            return {"status": "ok", "removed": self.remove(message["id"])}
+        if op == "command":
+            with self.lock:
+                camera = self.cameras.get(message.get("id"))
+            if camera is None:
+                return {"status": "error", "message": f"Camera {message.get('id')} not registered"}
+            return camera.request(message)
+        return {"status": "error", "message": f"Unknown op {op}"}
+
+    def add(self, camera_id, url=None, index=DEFAULT_WEBCAM_INDEX):
+        with self.spawn_lock:
+            with self.lock:
+                existing = self.cameras.get(camera_id)
+            if existing is not None and existing.same_source(url, index):
+                return {"status": "ok", "camera": existing.info()}
+            if existing is not None:
+                # Layout tetap (ada di disk), background sumber lama tidak berlaku untuk sumber baru
+                existing.stop(snapshot=False)
+            camera = self._spawn(camera_id, url or None, index, discard_background=existing is not None)
+        if not camera.ready.wait(CAMERA_WORKER_START_TIMEOUT):
+            self.remove(camera_id)
+            return {"status": "error", "message": f"Camera process {camera_id} did not start"}
+        return {"status": "ok", "camera": camera.info()}
+
+    def _spawn(self, camera_id, url, index, discard_background=False):
+        self.generation += 1
+        prefix = f"pk{os.getpid()}g{self.generation}"
+        camera = CameraProcess({
+            "id": camera_id,
+            "url": url,
+            "index": index,
+            "source": url or f"webcam {index}",
+            "generation": self.generation,
+            "frame_ring": prefix + "f",
+            "state_ring": prefix + "s",
+            "discard_background": discard_background
+        })
+        with self.lock:
+            self.cameras[camera_id] = camera
+        camera.start(self.env())
+        return camera
+
+    def remove(self, camera_id):
+        with self.spawn_lock:
+            with self.lock:
+                camera = self.cameras.pop(camera_id, None)
+                if self.active_id == camera_id:
+                    self.active_id = None
+            if camera is not None:
+                camera.stop()
+        return camera is not None
+
+    def _watchdog(self):
+        """Proses kamera yang crash dijalankan ulang (generation baru, web worker ikut pindah)"""
+        while not self.stop_event.wait(2.0):
+            for camera in self.all():
+                if not camera.ready.is_set() or camera.alive():
+                    continue
+                config = camera.config
+                with self.spawn_lock:
+                    with self.lock:
+                        if self.cameras.get(config["id"]) is not camera:
+                            continue
+                    print(f"✗ Camera process {config['id']} exited ({camera.process.returncode}), restarting")
+                    camera.stop()
+                    self._spawn(config["id"], config["url"], config["index"])
+
+class BusConnection:
+    """
+    Satu koneksi bus: pesan JSON satu baris di atas socket Unix. Socket biasa
+    (bukan multiprocessing.connection) supaya tetap kooperatif di mode
+    eventlet/gevent, dan JSON supaya pesan dari socket tidak pernah di-unpickle.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    @classmethod
+    def connect(cls, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return cls(sock)
+
+    def send(self, message):
+        self.sock.sendall(json.dumps(message).encode() + b"\n")
+
+    def recv(self):
+        line = self.reader.readline()
+        if not line:
+            raise EOFError("bus connection closed")
+        return json.loads(line)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+class LocalBus:
+    """
+    Pengganti ProcessBus di dalam satu proses (test / debugging): pesan
+    langsung diteruskan ke handler, mis. CameraSupervisor.handle. Pesan dan
+    balasan tetap lewat JSON supaya perilakunya sama dengan bus antar proses.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def request(self, message):
+        reply = self.handler(json.loads(json.dumps(message)))
+        return json.loads(json.dumps(reply))
+
+class ProcessBus:
+    """
+    Bus perintah web worker -> supervisor lewat BusConnection. Koneksi
+    di-pool supaya perintah yang lambat (reset background) tidak menahan
+    request lain di worker yang sama.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.idle = []
+
+    def request(self, message):
+        conn = self.idle.pop() if self.idle else BusConnection.connect(self.path)
+        try:
+            conn.send(message)
+            reply = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        self.idle.append(conn)
+        return reply
+
+class SharedFrameSource:
+    """
+    Chunk MJPEG kamera di web worker. Satu poller per kamera per proses
+    menyalin chunk baru dari SharedRing sekali, semua viewer di proses ini
+    menunggu di Condition lokal dan memakai bytes yang sama. Poller hanya
+    jalan selama ada viewer, dan selama itu menandai ring supaya proses
+    kamera tetap encode.
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.cond = Condition()
+        self.seq = 0
+        self.timestamp = 0.0
+        self.chunk = None
+        self.decoded_seq = 0
+        self.decoded = None
+        # Profil selain "full" di-encode ulang dari chunk ring, sekali per profil per worker
+        self.transcoder = MjpegBroadcaster(self)
+        self.last_wait = 0.0
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = Thread(target=self._poll, daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.closed = True
+
+    def _poll(self):
+        while not self.closed and time.time() - self.last_wait < RING_DEMAND_TIMEOUT:
+            self.ring.touch()
+            if self.ring.seq() != self.seq:
+                seq, timestamp, chunk = self.ring.read()
+                if chunk is not None:
+                    with self.cond:
+                        self.seq, self.timestamp, self.chunk = seq, timestamp, chunk
+                        self.cond.notify_all()
+            time.sleep(RING_POLL_INTERVAL)
+
+    def next_chunk(self, last_seq, quality=70, max_width=1280, timeout=1.0):
+        """Sama seperti MjpegBroadcaster.next_chunk; profil "full" tanpa encode"""
+        full = STREAM_PROFILES["full"]
+        if (quality, max_width) != (full["quality"], full["max_width"]):
+            return self.transcoder.next_chunk(last_seq, quality, max_width, timeout)
+        self.last_wait = time.time()
+        self.start()
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            if self.closed or self.chunk is None or self.seq == last_seq:
+                return last_seq, None
+            return self.seq, self.chunk
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        """Frame hasil decode chunk ring untuk transcoder, di-decode sekali per seq"""
+        seq, chunk = self.next_chunk(last_seq, timeout=timeout)
+        if chunk is None:
+            return last_seq, None
+        with self.cond:
+            if seq == self.decoded_seq:
+                return seq, self.decoded
+        jpeg = np.frombuffer(chunk, dtype=np.uint8, offset=chunk.index(b'\r\n\r\n') + 4)[:-2]
+        frame = run_blocking(cv2.imdecode, jpeg, cv2.IMREAD_COLOR)
+        with self.cond:
+            if seq > self.decoded_seq:
+                self.decoded_seq, self.decoded = seq, frame
+        return seq, frame
+
+class RemotePipeline:
+    """
+    Kamera yang jalan di proses lain, dilihat dari web worker. Interface sama
+    dengan CameraPipeline untuk route: chunk MJPEG dari SharedRing frame,
+    status / debug dari SharedRing state, perintah lewat bus. Watcher
+    memantau ring state dan push status_diff ke client Socket.IO worker ini.
+    """
+
+    def __init__(self, info, bus):
+        self.info = info
+        self.camera_id = info["id"]
+        self.generation = info["generation"]
+        self.bus = bus
+        self.engine = SharedFrameSource(SharedRing(info["frame_ring"]))
+        self.engine.transcoder.name = self.camera_id
+        self.broadcaster = self.engine
+        self.states = SharedRing(info["state_ring"])
+        self.state_seq = 0
+        self.state = {"status": {}, "layout_version": 0, "status_version": 0, "debug": {}}
+        self.published = None
+        self.status_log = StatusLog()  # versi ikut proses kamera, jadi ETag sama di semua worker
+        self.layout = SlotLayout()
+        self.closed = False
+        self.refresh()
+        Thread(target=self._watch, daemon=True).start()
+
+    def source(self):
+        return self.info["source"]
+
+    def start(self):
+        pass  # capture jalan di proses kamera
+
+    def close(self):
+        self.closed = True
+        self.engine.close()
+        self.engine.ring.close()
+        self.states.close()
+
+    def _request(self, cmd, **args):
+        reply = self.bus.request({"op": "command", "id": self.camera_id, "cmd": cmd, "args": args})
+        if reply.get("status") == "error":
+            raise RuntimeError(reply.get("message"))
+        return reply
+
+    def command(self, cmd, **args):
+        reply = self._request(cmd, **args)
+        self.refresh()
+        return reply
+
+    def refresh(self):
+        """
+        Baca state terbaru dari shared memory (murah kalau tidak berubah).
+        Versi status baru dicatat ke status_log dan di-push ke client Socket.IO
+        worker ini sebagai diff terhadap status terakhir yang dilihat.
+        """
+        if self.closed or self.states.seq() == self.state_seq:
+            return
+        seq, timestamp, payload = self.states.read()
+        if payload is None:
+            return
+        self.state_seq, self.state = seq, json.loads(payload)
+        status = self.state["status"]
+        if self.published is None:
+            # Attach pertama: worker ini tidak punya riwayat sebelum versi ini
+            self.published = status
+            self.status_log.reset(self.state["status_version"])
+        elif self.state["status_version"] != self.status_log.version:
+            changes = {slot_id: state for slot_id, state in status.items() if self.published.get(slot_id) != state}
+            removed = [slot_id for slot_id in self.published if slot_id not in status]
+            self.published = status
+            self.status_log.append(changes, removed, self.state["status_version"])
+            if changes or removed:
+                socketio.emit('status_diff', {
+                    "camera": self.camera_id,
+                    "changes": changes,
+                    "removed": removed,
+                    "layout_version": self.state["layout_version"]
+                }, to=f"camera:{self.camera_id}")
+        if self.state["layout_version"] != self.layout.version:
+            self.layout = SlotLayout.from_columns(self._request("layout"))
+            self.status_log.notify()
+
+    def _watch(self):
+        while not self.closed:
+            time.sleep(0.05)
+            try:
+                self.refresh()
+            except Exception as e:
+                if not self.closed:
+                    print(f"Error in status watcher: {str(e)}")
+
+    def status(self):
+        self.refresh()
+        return dict(self.state["status"])
+
+    def status_version(self):
+        return f"{self.state['layout_version']}.{self.status_log.version}"
+
+    def status_since(self, token):
+        self.refresh()
+        return status_since(self.status_log, self.state["layout_version"], token)
+
+    def wait_status(self, token, timeout):
+        # Watcher yang membaca ring dan membangunkan request ini
+        return self.status_log.wait(lambda: self.status_version() != token, timeout)
+
+    def debug_info(self):
+        self.refresh()
+        return dict(self.state["debug"], generation=self.generation)
+
+    def wait_frame(self, timeout=10.0):
+        """Decode chunk terbaru (hanya untuk registrasi / reset, bukan jalur stream)"""
+        deadline = time.time() + timeout
+        seq, chunk = self.engine.seq, self.engine.chunk
+        while chunk is None and time.time() < deadline:
+            seq, chunk = self.engine.next_chunk(seq, timeout=min(1.0, max(0.0, deadline - time.time())))
+        if chunk is None:
+            return None
+        jpeg = chunk[chunk.index(b'\r\n\r\n') + 4:-2]
+        return run_blocking(cv2.imdecode, np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def set_layout(self, layout):
+        return self.command("set_layout", layout=layout.to_columns())["changed"]
+
+    def set_slots(self, new_slots):
+        return self.command("set_slots", slots=new_slots)["changed"]
+
+    def set_detection_scale(self, scale):
+        self.command("set_detection_scale", scale=scale)
+
+    def reset_background(self):
+        if not self.command("reset_background")["changed"]:
+            return None
+        return self.wait_frame(timeout=3.0)
+
+class RemoteCameraManager:
+    """
+    CameraManager versi web worker: registry ada di supervisor (lewat bus),
+    pipeline-nya RemotePipeline yang membaca SharedRing proses kamera.
+    Daftar kamera disinkronkan paling sering sekali per REMOTE_SYNC_INTERVAL.
+    """
+
+    supports_mobile = False  # frame HP masuk ke satu worker, tidak ke proses kamera
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.lock = Lock()
+        self.cameras = {}  # {camera_id: RemotePipeline}
+        self.active = None
+        self.synced = 0.0
+
+    @property
+    def active_id(self):
+        self.sync()
+        return self.active
+
+    @active_id.setter
+    def active_id(self, camera_id):
+        self.bus.request({"op": "set_active", "id": camera_id})
+        self.active = camera_id
+
+    def sync(self, force=False):
+        if not force and time.time() - self.synced < REMOTE_SYNC_INTERVAL:
+            return
+        self.synced = time.time()
+        listing = self.bus.request({"op": "list"})
+        with self.lock:
+            self.active = listing["active"]
+            for camera_id in list(self.cameras):
+                info = listing["cameras"].get(camera_id)
+                if info is None or info["generation"] != self.cameras[camera_id].generation:
+                    self.cameras.pop(camera_id).close()
+        for info in listing["cameras"].values():
+            self._attach(info)
+
+    def _attach(self, info):
+        with self.lock:
+            pipeline = self.cameras.get(info["id"])
+            if pipeline is not None and pipeline.generation == info["generation"]:
+                return pipeline
+        try:
+            pipeline = RemotePipeline(info, self.bus)
+        except FileNotFoundError:
+            return None  # proses kamera baru saja berhenti
+        with self.lock:
+            previous = self.cameras.get(info["id"])
+            self.cameras[info["id"]] = pipeline
+        if previous is not None:
+            previous.close()
+        return pipeline
+
+    def get(self, camera_id=None):
+        self.sync()
+        with self.lock:
+            pipeline = self.cameras.get(camera_id or self.active)
+        if pipeline is None and camera_id:
+            # Mungkin baru didaftarkan lewat worker lain
+            self.sync(force=True)
+            with self.lock:
+                pipeline = self.cameras.get(camera_id)
+        return pipeline
+
+    def add(self, camera_id, url=None, index=DEFAULT_WEBCAM_INDEX, token=None):
+        reply = self.bus.request({"op": "add", "id": camera_id, "url": url, "index": index})
+        if reply.get("status") != "ok":
+            raise RuntimeError(reply.get("message"))
+        return self._attach(reply["camera"])
+
+    def remove(self, camera_id):
+        removed = self.bus.request({"op": "remove", "id": camera_id})["removed"]
+        with self.lock:
+            pipeline = self.cameras.pop(camera_id, None)
+            if self.active == camera_id:
+                self.active = None
+        if pipeline is not None:
+            pipeline.close()
+        return removed
+
+    def all(self):
+        self.sync()
+        with self.lock:
+            return list(self.cameras.values())
+
+def parse_webcam_index(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_WEBCAM_INDEX
+
+def register_camera_response(camera_id, data):
+    """Daftarkan kamera lalu tunggu frame pertama (kecuali wait=false)"""
+    ip = data.get("ip")
+    token = data.get("token")
+    if token and not camera_manager.supports_mobile:
+        return jsonify({"status": "error", "message": "Mobile camera needs WEB_WORKERS=1"}), 400
+    if token and token not in mobile_sessions:
+        return jsonify({"status": "error", "message": "Invalid or expired token"}), 400
+    detection_scale = data.get("detection_scale")
+    if detection_scale:
+        try:
+            detection_scale = float(detection_scale)
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "Invalid detection_scale"}), 400
+
+    try:
+        pipeline = camera_manager.add(camera_id, ip or None, parse_webcam_index(data.get("index")), token)
+    except RuntimeError as e:  # mode multi-proses: proses kamera gagal start
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if "slots" in data:
+        pipeline.set_slots(data.get("slots") or [])
+    if detection_scale:
+        pipeline.set_detection_scale(detection_scale)
+
+    # HP mungkin belum mulai streaming, jadi jangan tunggu frame pertama
+    if data.get("wait") is False or token:
+        return jsonify({"status": "ok", "camera_id": camera_id, "camera": pipeline.source()})
+
+    frame = pipeline.wait_frame(timeout=10.0)
+    if frame is not None:
+        print(f"Camera test successful! Frame shape: {frame.shape}")
+        return jsonify({
+            "status": "ok",
+            "camera_id": camera_id,
+            "camera": pipeline.source(),
+            "resolution": f"{frame.shape[1]}x{frame.shape[0]}"
+        })
+    else:
+        camera_manager.remove(camera_id)
+        return jsonify({
+            "status": "error",
+            "message": "Failed to open camera"
+        }), 400
+
+def client_socket(environ):
+    """Socket client request ini, kalau server WSGI-nya mengekspos (Werkzeug, eventlet, gevent)"""
+    sock = environ.get("werkzeug.socket")
+    if sock is None:
+        stream = environ.get("eventlet.input") or environ.get("wsgi.input")
+        sock = getattr(stream, "_sock", None) or getattr(stream, "socket", None)
+    return sock
+
+def video_response(pipeline):
+    """MJPEG ?profile=thumbnail|mobile|full (default STREAM_PROFILE), ?adapt=0 mematikan adaptasi"""
+    profile = request.args.get("profile") or DEFAULT_STREAM_PROFILE
+    if profile not in STREAM_PROFILES:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown profile '{profile}', use one of: {', '.join(STREAM_PROFILES)}"
+        }), 400
+    pacer = StreamPacer(profile, adapt=request.args.get("adapt") not in ("0", "false"))
+    sock = client_socket(request.environ)
+    if sock is not None and len(pacer.steps) > 1:
+        # Buffer kecil supaya yield ikut tertahan saat client tertinggal
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SEND_BUFFER)
+        except OSError:
+            pass
+
+    def generate():
+        pipeline.start()
+        last_seq = 0
+
+        while True:
+            pacer.wait()
+            # Blok sampai ada frame baru; JPEG-nya di-share dengan viewer lain di profil yang sama
+            try:
+                quality, max_width = pacer.settings()
+                seq, chunk = pipeline.broadcaster.next_chunk(last_seq, quality, max_width)
+            except Exception as e:
+                print(f"Error in video stream: {str(e)}")
+                time.sleep(0.1)
+                continue
+            if chunk is None:
+                continue
+            last_seq = seq
+            captured_at = pipeline.engine.timestamp if pipeline.engine.seq == seq else None
+            # Waktu sampai generator dilanjutkan = waktu server menulis ke socket client
+            started = time.time()
+            with metrics.time("stream_send", camera=pipeline.camera_id):
+                yield chunk
+            metrics.inc("parking_stream_bytes_total", len(chunk), camera=pipeline.camera_id, profile=pacer.profile)
+            change = pacer.sent(started, time.time() - started)
+            if change:
+                metrics.inc("parking_stream_downgrades_total" if change < 0 else "parking_stream_upgrades_total",
+                            camera=pipeline.camera_id, profile=profile)
+            # Umur frame: grab dari kamera sampai selesai ditulis ke client
+            if captured_at:
+                metrics.observe("frame_age", time.time() - captured_at, camera=pipeline.camera_id)
+
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+def reset_background_response(pipeline):
+    frame = pipeline.reset_background()
+    if frame is not None:
+        print(f"Background reset ({pipeline.camera_id})! Frame shape: {frame.shape}")
+        return jsonify({
+            "status": "ok",
+            "message": "Background reset berhasil! Sekarang frame ini akan jadi referensi kosong."
+        })
+    else:
+        return jsonify({
+            "status": "error",
+            "message": "Gagal mengambil frame untuk background"
+        }), 400
+
+def update_slots_response(pipeline):
+    data = request.get_json(silent=True)
+    # Body rusak / tanpa list "slots" ditolak, jangan sampai dianggap layout kosong
+    if not isinstance(data, dict) or not isinstance(data.get("slots"), list):
+        return jsonify({"status": "error", "message": 'Body must be JSON {"slots": [...]}'}), 400
+    try:
+        layout = SlotLayout.from_slots(data["slots"])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Invalid slots: {str(e)}"}), 400
+    pipeline.set_layout(layout)
+    print(f"Updated slots ({pipeline.camera_id}): {len(pipeline.layout)} slots received")
+    return jsonify({"status": "ok", "slots_count": len(pipeline.layout),
+                    "layout_version": pipeline.layout.version})
+
+def status_response(pipeline):
+    """
+    Status dari hasil deteksi yang di-cache, tanpa deteksi ulang per request.
+    ETag "<versi layout>.<versi status>": If-None-Match yang masih sama -> 304.
+    ?since=<etag> hanya slot yang berubah sejak versi itu; ?wait=<detik> menahan
+    request (long-poll) sampai status berubah atau timeout.
+    """
+    since = request.args.get("since")
+    known = since.strip('"') if since else next(iter(request.if_none_match.as_set()), None)
+    try:
+        wait = min(float(request.args.get("wait") or 0), STATUS_MAX_WAIT)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid wait"}), 400
+    if wait > 0:
+        pipeline.wait_status(known or pipeline.status_version(), wait)
+
+    version = pipeline.status_version()
+    if known == version:
+        response = Response(status=304)
+    elif since is not None:
+        version, changes, removed = pipeline.status_since(since)
+        response = jsonify({
+            "version": version,
+            "full": changes is None,
+            "changes": pipeline.status() if changes is None else changes,
+            "removed": removed or [],
+            "layout_version": pipeline.layout.version
+        })
+    else:
+        response = jsonify(pipeline.status())
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Layout-Version"] = str(pipeline.layout.version)
+    return response
+
+def camera_not_found(camera_id):
+    return jsonify({"status": "error", "message": f"Camera {camera_id} not registered"}), 404
+
+@app.route("/cameras", methods=["GET"])
+def list_cameras():
+    return jsonify({
+        "active": camera_manager.active_id,
+        "cameras": [{"id": p.camera_id, "camera": p.source(), "slots_count": len(p.layout),
+                     "layout_version": p.layout.version}
+                    for p in camera_manager.all()]
+    })
+
+@app.route("/cameras", methods=["POST"])
+def add_camera():
+    data = request.get_json()
+    camera_id = data.get("id")
+    if not camera_id:
+        return jsonify({"status": "error", "message": "id is required"}), 400
+    return register_camera_response(camera_id, data)
+
+@app.route("/cameras/<camera_id>", methods=["DELETE"])
+def remove_camera(camera_id):
+    if not camera_manager.remove(camera_id):
+        return camera_not_found(camera_id)
+    return jsonify({"status": "ok"})
+
+@app.route("/cameras/<camera_id>/video")
+def camera_video(camera_id):
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    return video_response(pipeline)
+
+@app.route("/cameras/<camera_id>/status")
+def camera_status(camera_id):
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    return status_response(pipeline)
+
+@app.route("/cameras/<camera_id>/slots", methods=["POST"])
+def camera_slots(camera_id):
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    return update_slots_response(pipeline)
+
+@app.route("/cameras/<camera_id>/layout", methods=["GET"])
+def export_layout(camera_id):
+    """Export layout format kolom {version, ids, x, y, w, h}"""
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    response = jsonify(pipeline.layout.to_columns())
+    response.headers["X-Layout-Version"] = str(pipeline.layout.version)
+    return response
+
+@app.route("/cameras/<camera_id>/layout", methods=["PUT"])
+def import_layout(camera_id):
+    """
+    Import layout sekaligus: format kolom (hasil export) atau {"slots": [...]}.
+    If-Match: <version> opsional untuk menolak import di atas layout yang sudah berubah.
+    """
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    expected = request.headers.get("If-Match", "").strip('"')
+    if expected and expected != str(pipeline.layout.version):
+        return jsonify({"status": "error", "message": "Layout version mismatch",
+                        "layout_version": pipeline.layout.version}), 412
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ("slots" in data and not isinstance(data["slots"], list)):
+        return jsonify({"status": "error", "message": 'Body must be a JSON layout object or {"slots": [...]}'}), 400
+    try:
+        if "slots" in data:
+            layout = SlotLayout.from_slots(data["slots"])
+        else:
+            layout = SlotLayout.from_columns(data, version=0)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Invalid layout: {str(e)}"}), 400
+
+    pipeline.set_layout(layout)
+    print(f"Imported layout ({camera_id}): {len(pipeline.layout)} slots, version {pipeline.layout.version}")
+    return jsonify({"status": "ok", "slots_count": len(pipeline.layout),
+                    "layout_version": pipeline.layout.version})
+
+@app.route("/cameras/<camera_id>/reset_background", methods=["POST"])
+def camera_reset_background(camera_id):
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    return reset_background_response(pipeline)
+
+@app.route("/cameras/<camera_id>/debug")
+def camera_debug(camera_id):
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is None:
+        return camera_not_found(camera_id)
+    return jsonify(pipeline.debug_info())
+
+@app.route("/video")
+def video():
+    # ?cam=<id> dari dashboard; kalau belum terdaftar pakai kamera aktif
+    pipeline = camera_manager.get(request.args.get("cam")) or camera_manager.get()
+    if pipeline is None:
+        return camera_not_found(request.args.get("cam"))
+    return video_response(pipeline)
+
+@app.route("/status")
+def status():
+    # Baca hasil deteksi terakhir dari detection loop (tanpa deteksi ulang)
+    pipeline = camera_manager.get(request.args.get("cam"))
+    if pipeline is None:
+        return jsonify({})
+    return status_response(pipeline)
+
+@app.route("/debug")
+def debug():
+    """Debug endpoint to check system status"""
+    pipeline = camera_manager.get()
+    debug_info = pipeline.debug_info() if pipeline else {"camera_opened": False}
+    debug_info["cameras"] = [p.camera_id for p in camera_manager.all()]
+    debug_info["mobile_sessions"] = mobile_sessions.stats()
+    return jsonify(debug_info)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Metrics format Prometheus (histogram per tahap + counter + gauge)"""
+    gauges = []
+    for pipeline in camera_manager.all():
+        labels = {"camera": pipeline.camera_id}
+        info = pipeline.debug_info()  # mode multi-proses: dari state proses kamera
+        gauges.append(("parking_frame_seq", labels, info["frame_seq"]))
+        gauges.append(("parking_slots", labels, len(pipeline.layout)))
+        gauges.append(("parking_layout_version", labels, pipeline.layout.version))
+        for name, value in info["motion_gate"].items():
+            gauges.append((f"parking_motion_gate_{name}", labels, value))
+        for name, value in (info.get("recorder") or {}).items():
+            gauges.append((f"parking_recorder_{name}", labels, value))
+    mobile_stats = mobile_sessions.stats()
+    gauges.append(("parking_mobile_sessions", {}, mobile_stats["sessions"]))
+    gauges.append(("parking_mobile_session_bytes", {}, mobile_stats["bytes"]))
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+def parse_time(value, default):
+    """Unix timestamp (detik) atau ISO 8601"""
+    if value in (None, ""):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def history_range():
+    end = parse_time(request.args.get("to"), time.time())
+    start = parse_time(request.args.get("from"), end - 86400)
+    return start, end
+
+def parse_limit(default):
+    """?limit= positif; SQLite menganggap LIMIT negatif sebagai tanpa batas"""
+    limit = int(request.args.get("limit", default))
+    if limit <= 0:
+        raise ValueError("limit must be a positive integer")
+    return limit
+
+@app.route("/history")
+def history():
+    """Transisi slot: /history?camera=&slot=&from=&to=&limit="""
+    try:
+        start, end = history_range()
+        limit = parse_limit(10000)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    result = run_blocking(history_store.query, start, end, request.args.get("camera"), request.args.get("slot"), limit)
+    result.update({"from": start, "to": end})
+    return jsonify(result)
+
+@app.route("/history/utilization")
+def history_utilization():
+    """Utilisasi per slot: /history/utilization?camera=&slot=&from=&to="""
+    try:
+        start, end = history_range()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({
+        "from": start,
+        "to": end,
+        "slots": run_blocking(history_store.utilization, start, end,
+                              request.args.get("camera"), request.args.get("slot"))
+    })
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def clip_path(camera_id, clip_id, suffix):
+    return os.path.abspath(os.path.join(camera_file(CLIP_DIR, camera_id, ""), f"{clip_id}{suffix}"))
+
+@app.route("/cameras/<camera_id>/clips")
+def camera_clips(camera_id):
+    """Klip transisi kamera: /cameras/<id>/clips?slot=&from=&to=&limit="""
+    try:
+        start, end = history_range()
+        limit = parse_limit(100)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    clips = run_blocking(history_store.clips, start, end, camera_id, request.args.get("slot"), limit)
+    for clip in clips:
+        clip["url"] = f"/cameras/{camera_id}/clips/{clip['clip']}/video"
+    return jsonify({"from": start, "to": end, "clips": clips})
+
+@app.route("/cameras/<camera_id>/clips/<int:clip_id>")
+def camera_clip(camera_id, clip_id):
+    """Metadata klip: transisi, rentang waktu, index frame (ts, offset, panjang)"""
+    try:
+        with open(clip_path(camera_id, clip_id, ".json")) as f:
+            return Response(f.read(), mimetype="application/json")
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": f"Clip {clip_id} not found"}), 404
+
+@app.route("/cameras/<camera_id>/clips/<int:clip_id>/video")
+def camera_clip_video(camera_id, clip_id):
+    """Putar klip sebagai MJPEG dengan timing asli; ?download=1 untuk file .mjpeg mentah"""
+    path = clip_path(camera_id, clip_id, ".mjpeg")
+    try:
+        with open(clip_path(camera_id, clip_id, ".json")) as f:
+            frames = json.load(f)["frames"]
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": f"Clip {clip_id} not found"}), 404
+    try:
+        if request.args.get("download") in ("1", "true"):
+            return send_file(path, mimetype="video/x-motion-jpeg", as_attachment=True,
+                             download_name=f"{camera_id}-{clip_id}.mjpeg")
+        data = run_blocking(read_file, path)
+    except FileNotFoundError:  # dipangkas recorder setelah metadata dibaca
+        return jsonify({"status": "error", "message": f"Clip {clip_id} not found"}), 404
+
+    def generate():
+        previous = None
+        for ts, offset, length in frames:
+            if previous is not None:
+                time.sleep(min(1.0, max(0.0, ts - previous)))
+            previous = ts
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + data[offset:offset + length] + b'\r\n')
+
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route("/test_camera", methods=["GET"])
+def test_camera():
+    """Inventaris kamera dari cache (langsung); ?refresh=1 untuk memicu probe ulang"""
+    return jsonify(camera_discovery.inventory(force=request.args.get("refresh") in ("1", "true")))
+
+@socketio.on('subscribe_status')
+def handle_subscribe_status(data):
+    """Client join room kamera dan langsung dapat snapshot status terakhir"""
+    camera_id = data.get('camera') or "default"
+    join_room(f"camera:{camera_id}")
+    pipeline = camera_manager.get(camera_id)
+    if pipeline is not None:
+        emit('status_diff', {"camera": camera_id, "changes": pipeline.status(), "removed": [],
+                             "layout_version": pipeline.layout.version})
+
+@socketio.on('unsubscribe_status')
+def handle_unsubscribe_status(data):
+    leave_room(f"camera:{data.get('camera') or 'default'}")
+
+def store_mobile_frame(token, frame_bytes):
+    """Simpan JPEG terbaru dari HP; False kalau token tidak valid / frame terlalu besar"""
+    with metrics.time("mobile_ingest"):
+        stored = mobile_sessions.push(token, frame_bytes)
+    metrics.inc("parking_mobile_frames_total", result="stored" if stored else "rejected")
+    if stored:
+        metrics.inc("parking_mobile_bytes_total", len(frame_bytes))
+    return stored
+
+@socketio.on('mobile_hello')
+def handle_mobile_hello(data):
+    """Negosiasi ingest binary: ukuran, kualitas JPEG dan jumlah credit awal"""
+    token = data.get('token') if isinstance(data, dict) else None
+    if token not in mobile_sessions:
+        emit('mobile_error', {'message': 'Invalid or expired token'})
+        return
+
+    try:
+        width = max(0, int(float(data.get('width') or MOBILE_MAX_WIDTH)))
+        height = max(0, int(float(data.get('height') or 0)))
+    except (TypeError, ValueError, OverflowError):
+        emit('mobile_error', {'message': 'Invalid width/height'})
+        return
+    scale = min(1.0, MOBILE_MAX_WIDTH / width) if width > 0 else 1.0
+
+    mobile_credits[request.sid] = 0
+    emit('mobile_config', {
+        'binary': bool(data.get('binary', True)),
+        'width': int(width * scale),
+        'height': int(height * scale),
+        'quality': MOBILE_JPEG_QUALITY,
+        'credits': MOBILE_FRAME_CREDITS
+    })
+
+@socketio.on('mobile_frame_bin')
+def handle_mobile_frame_bin(data):
+    """Terima JPEG mentah (binary attachment), tanpa base64"""
+    store_mobile_frame(data.get('token'), data.get('frame'))
+
+    # Flow control pakai credit: kembalikan credit per setengah window, bukan ACK per frame.
+    # Frame yang ditolak tetap dihitung supaya credit HP tidak habis.
+    received = mobile_credits.get(request.sid, 0) + 1
+    refill = max(1, MOBILE_FRAME_CREDITS // 2)
+    if received >= refill:
+        emit('mobile_credit', {'credits': received})
+        received = 0
+    mobile_credits[request.sid] = received
+
+@socketio.on('mobile_frame')
+def handle_mobile_frame(data):
+    """Receive frame from mobile (client lama: data URL base64)"""
+    token = data.get('token')
+    frame_base64 = data.get('frame')
+    
+    if token in mobile_sessions:
+        # Decode base64 to bytes
+        frame_bytes = base64.b64decode(frame_base64.split(',')[1])
+        if store_mobile_frame(token, frame_bytes):
+            emit('frame_received', {'status': 'ok'})
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    mobile_credits.pop(request.sid, None)
+
+@app.route("/set_public_url", methods=["POST"])
+def set_public_url():
+    """Set public URL dari cloudflare tunnel"""
+    global PUBLIC_URL
+    data = request.get_json()
+    url = data.get("url", "").strip()
+    
+    if url:
+        # Pastikan URL tidak berakhir dengan slash
+        PUBLIC_URL = url.rstrip('/')
+        print(f"✓ Public URL set to: {PUBLIC_URL}")
+        return jsonify({"status": "ok", "url": PUBLIC_URL})
     else:
         PUBLIC_URL = None
         print("✓ Public URL cleared (using local IP)")
         return jsonify({"status": "ok", "message": "Using local IP"})
 
+def run_camera_worker(config):
+    """Proses kamera: python app.py --camera-worker <config JSON dari supervisor>"""
+    worker = CameraWorker(config)
+    worker.start()
+    print(f"✓ Camera process {config['id']} (pid {os.getpid()}): {config['source']}")
+    conn = BusConnection.connect(os.environ["PARKING_BUS"])
+    conn.send({"op": "camera_hello", "id": config["id"], "generation": config["generation"]})
+    try:
+        worker.serve(conn)
+    finally:
+        worker.stop()
+        worker.close()
+
+def run_web_worker():
+    """Web worker: python app.py --web-worker, socket listen diwarisi dari supervisor"""
+    global camera_manager
+    camera_manager = RemoteCameraManager(ProcessBus(os.environ["PARKING_BUS"]))
+    listener = socket.socket(fileno=int(os.environ["PARKING_LISTEN_FD"]))
+
+    # Supervisor mati (mis. kill -9) -> worker ikut berhenti, jangan pegang port
+    parent = os.getppid()
+    def watch_parent():
+        while os.getppid() == parent:
+            time.sleep(1.0)
+        os._exit(0)
+    Thread(target=watch_parent, daemon=True).start()
+
+    print(f"✓ Web worker {os.getpid()} ready")
+    if ASYNC_MODE == "eventlet":
+        import eventlet.wsgi
+        eventlet.wsgi.server(listener, app, log_output=False, minimum_chunk_size=0)
+    else:
+        from gevent import pywsgi
+        from geventwebsocket.handler import WebSocketHandler  # dicek supervisor sebelum start
+        pywsgi.WSGIServer(listener, app, log=None, handler_class=WebSocketHandler).serve_forever()
+
+def run_supervisor(port=5000):
+    """
+    WEB_WORKERS proses web berbagi satu socket listen, ditambah satu proses per
+    kamera. Supervisor sendiri hanya melayani bus perintah dan registry kamera.
+    """
+    supervisor = CameraSupervisor()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", port))
+    listener.listen(1024)
+    env = dict(supervisor.env(), PARKING_ROLE="web", PARKING_LISTEN_FD=str(listener.fileno()))
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--web-worker"],
+                                env=env, pass_fds=(listener.fileno(),))
+               for _ in range(WEB_WORKERS)]
+    # SIGTERM (systemd / docker stop) dibersihkan sama seperti Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        supervisor.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        supervisor.stop()
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--camera-worker"]:
+        run_camera_worker(json.loads(sys.argv[2]))
+        sys.exit(0)
+    if sys.argv[1:2] == ["--web-worker"]:
+        run_web_worker()
+        sys.exit(0)
+
     print("=" * 50)
     print("Smart Parking System Backend Starting...")
     print("=" * 50)
@@ -570,26 +3853,29 @@ if __name__ == "__main__":
     LOCAL_IP = get_local_ip()
     print(f"Local IP: {LOCAL_IP}")
     
-    # Cek cloudflare tunnel
-    if detect_cloudflare_tunnel():
-        print("⚠ Cloudflare tunnel detected!")
-        print("Set public URL via: POST /set_public_url")
-    
+    # Cek cloudflare tunnel & kamera di background, server langsung menerima request
+    def check_tunnel():
+        if detect_cloudflare_tunnel():
+            print("⚠ Cloudflare tunnel detected!")
+            print("Set public URL via: POST /set_public_url")
+    Thread(target=check_tunnel, daemon=True).start()
+
     init_placeholder()
-    print("Testing available cameras...")
-    
-    # Test available cameras on startup
-    for i in range(3):
-        test_cap = cv2.VideoCapture(i)
-        if test_cap.isOpened():
-            ret, _ = test_cap.read()
-            if ret:
-                print(f"✓ Camera {i} available")
-            else:
-                print(f"✗ Camera {i} opened but cannot read")
-            test_cap.release()
-        else:
-            print(f"✗ Camera {i} not available")
+    multiprocess = WEB_WORKERS > 1 and ASYNC_MODE != "threading"
+    if WEB_WORKERS > 1 and not multiprocess:
+        print("✗ WEB_WORKERS > 1 needs ASYNC_MODE=eventlet/gevent, running single process")
+    if multiprocess and ASYNC_MODE == "gevent":
+        try:
+            import geventwebsocket
+        except ImportError:
+            # Tanpa WebSocket Socket.IO jatuh ke long-polling, yang sesinya hanya ada di
+            # satu web worker: request berikutnya masuk worker lain dan client putus terus
+            print("✗ WEB_WORKERS > 1 with gevent needs gevent-websocket (pip install gevent-websocket)")
+            sys.exit(1)
+    if not multiprocess:
+        # Web worker mem-probe sendiri saat /test_camera dipanggil
+        print("Testing available cameras in background...")
+        camera_discovery.refresh()
     
     print("=" * 50)
     print(f"Server running on:")
@@ -597,4 +3883,14 @@ if __name__ == "__main__":
     print(f"  Network:  http://{LOCAL_IP}:5000")
     print("=" * 50)
     
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    print(f"Async mode: {ASYNC_MODE}")
+    if multiprocess:
+        print(f"Web workers: {WEB_WORKERS}, satu proses per kamera")
+        run_supervisor()
+    elif ASYNC_MODE == "threading":
+        socketio.run(app, debug=True, host='0.0.0.0', port=5000)
+    else:
+        # Produksi: tanpa debugger/reloader Werkzeug, satu event loop untuk semua koneksi.
+        # eventlet defaultnya menahan tulisan < 4 KB, lebih besar dari chunk MJPEG thumbnail
+        options = {"minimum_chunk_size": 0} if ASYNC_MODE == "eventlet" else {}
+        socketio.run(app, host='0.0.0.0', port=5000, log_output=False, **options)
\ No newline at end of file
@@ -0,0 +1,846 @@
+"""
+Benchmark Smart Parking System (jalan tanpa kamera / browser).
+
+Contoh:
+    python benchmark.py mjpeg --viewers 1 5 10 25
+    python benchmark.py detect --slots 10 100 1000
+    python benchmark.py mobile --frames 200
+    python benchmark.py suite --slots 50 --width 1280 --height 720
+    python benchmark.py suite --footage rekaman.mp4 --slots-json slots.json
+    python benchmark.py layout --slots 1000 5000
+    python benchmark.py scale --scales 1 0.5 0.25
+    ASYNC_MODE=eventlet python app.py   # lalu dari terminal lain:
+    python benchmark.py viewers --register file:rekaman.mp4 --viewers 500 --duration 30
+    python benchmark.py latency --fps 30 --decode-ms 0 60 120
+    python benchmark.py pollers --camera loadtest --clients 1000 --mode full etag longpoll --pid <pid server>
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Event
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+import cv2
+import numpy as np
+
+import app
+
+
+class SyntheticCapture:
+    """Pengganti cv2.VideoCapture yang menghasilkan frame sintetis dengan FPS tetap"""
+
+    def __init__(self, width=1280, height=720, fps=30):
+        self.width = width
+        self.height = height
+        self.interval = 1.0 / fps if fps else 0
+        self.count = 0
+        self.next_time = time.time()
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if self.interval:
+            delay = self.next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time + self.interval, time.time())
+        self.count += 1
+        frame = np.full((self.height, self.width, 3), 80, dtype=np.uint8)
+        x = (self.count * 8) % max(1, self.width - 120)
+        cv2.rectangle(frame, (x, self.height // 3), (x + 120, self.height // 3 + 60), (0, 0, 255), -1)
+        cv2.putText(frame, str(self.count), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        return True, frame
+
+    def grab(self):
+        return True
+
+    def release(self):
+        self.opened = False
+
+
+def bench_mjpeg(args):
+    """Encodes/detik vs jumlah viewer: broadcaster (encode sekali) vs encode per client"""
+    print(f"{'viewers':>8} {'mode':>12} {'encodes/s':>10} {'client fps':>11}")
+
+    for viewers in args.viewers:
+        for mode in ("broadcaster", "per-client"):
+            engine = app.CaptureEngine(lambda: SyntheticCapture(args.width, args.height, args.fps))
+            broadcaster = app.MjpegBroadcaster(engine)
+            engine.start()
+            stop = Event()
+            delivered = [0] * viewers
+            per_client_encodes = [0] * viewers
+
+            def viewer(i):
+                last_seq = 0
+                while not stop.is_set():
+                    if mode == "broadcaster":
+                        seq, chunk = broadcaster.next_chunk(last_seq, timeout=0.5)
+                    else:
+                        seq, frame = engine.wait_frame(last_seq, timeout=0.5)
+                        chunk = broadcaster._encode(frame, 70, 1280) if frame is not None and seq != last_seq else None
+                        if chunk is not None:
+                            per_client_encodes[i] += 1
+                    if chunk is not None:
+                        last_seq = seq
+                        delivered[i] += 1
+
+            threads = [Thread(target=viewer, args=(i,), daemon=True) for i in range(viewers)]
+            for t in threads:
+                t.start()
+            time.sleep(args.duration)
+            stop.set()
+            for t in threads:
+                t.join()
+            engine.stop()
+
+            encodes = broadcaster.encodes if mode == "broadcaster" else sum(per_client_encodes)
+            print(f"{viewers:>8} {mode:>12} {encodes / args.duration:>10.1f} "
+                  f"{sum(delivered) / viewers / args.duration:>11.1f}")
+
+
+def legacy_detect(frame, background, slots):
+    """Versi lama detect_parking_status (loop Python per slot), untuk pembanding"""
+    results = {}
+    for slot in slots:
+        x, y, w, h = slot["x"], slot["y"], slot["w"], slot["h"]
+        y1 = max(0, int(y))
+        y2 = min(frame.shape[0], int(y + h))
+        x1 = max(0, int(x))
+        x2 = min(frame.shape[1], int(x + w))
+        if y2 <= y1 or x2 <= x1:
+            results[slot["id"]] = "empty"
+            continue
+        diff = cv2.absdiff(background[y1:y2, x1:x2], frame[y1:y2, x1:x2])
+        diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+        _, thresh = cv2.threshold(diff_gray, 30, 255, cv2.THRESH_BINARY)
+        change_ratio = np.sum(thresh > 0) / thresh.size
+        results[slot["id"]] = "occupied" if change_ratio > 0.05 else "empty"
+    return results
+
+
+def synthetic_lot(count, width, height, seed=0):
+    """Background kosong, frame dengan ~separuh slot terisi, dan layout slot (boleh overlap)"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(60, 100, (height, width, 3), dtype=np.uint8)
+    frame = background.copy()
+    slots = []
+    for i in range(count):
+        w = int(rng.integers(40, 120))
+        h = int(rng.integers(30, 90))
+        x = float(rng.integers(-10, width - 20))
+        y = float(rng.integers(-10, height - 20))
+        slots.append({"id": f"slot_{i + 1}", "x": x, "y": y, "w": w, "h": h})
+        if rng.random() < 0.5:
+            cv2.rectangle(frame, (int(x) + 5, int(y) + 5), (int(x + w) - 5, int(y + h) - 5),
+                          (200, 200, 200), -1)
+    return background, frame, slots
+
+
+def bench_detect(args):
+    """Slots/detik: detect_parking_status lama vs SlotDetector"""
+    print(f"{'slots':>6} {'legacy slots/s':>15} {'engine slots/s':>15} {'speedup':>8} {'match':>6}")
+
+    for count in args.slots:
+        background, frame, slots = synthetic_lot(count, args.width, args.height)
+        detector = app.SlotDetector(pixel_threshold=30)  # threshold legacy_detect
+        detector.set_slots(slots)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            legacy = legacy_detect(frame, background, slots)
+        legacy_time = (time.perf_counter() - start) / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            engine = detector.detect(frame, background)
+        engine_time = (time.perf_counter() - start) / args.repeat
+
+        print(f"{count:>6} {count / legacy_time:>15.0f} {count / engine_time:>15.0f} "
+              f"{legacy_time / engine_time:>7.1f}x {str(legacy == engine):>6}")
+
+
+def bench_mobile(args):
+    """Ingest frame HP: data URL base64 (lama) vs JPEG binary (dengan/tanpa downscale)"""
+    frame = SyntheticCapture(args.width, args.height, 0).read()[1]
+    token = "bench-token"
+    session = app.mobile_sessions.create(token)
+
+    small = cv2.resize(frame, None, fx=app.MOBILE_MAX_WIDTH / args.width, fy=app.MOBILE_MAX_WIDTH / args.width)
+    full_jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+    small_jpeg = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, int(app.MOBILE_JPEG_QUALITY * 100)])[1].tobytes()
+    data_url = "data:image/jpeg;base64," + base64.b64encode(full_jpeg).decode()
+
+    cases = [
+        ("base64", "mobile_frame", data_url, len(data_url)),
+        ("binary", "mobile_frame_bin", full_jpeg, len(full_jpeg)),
+        (f"binary@{app.MOBILE_MAX_WIDTH}", "mobile_frame_bin", small_jpeg, len(small_jpeg)),
+    ]
+
+    print(f"{'path':>12} {'frames/s':>10} {'bytes/frame':>12}")
+    for name, event, payload, size in cases:
+        client = app.socketio.test_client(app.app)
+        if event == "mobile_frame_bin":
+            client.emit('mobile_hello', {'token': token, 'width': args.width, 'height': args.height})
+        client.get_received()
+
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            client.emit(event, {'token': token, 'frame': payload})
+        elapsed = time.perf_counter() - start
+        client.get_received()
+        client.disconnect()
+
+        assert session.jpeg in (full_jpeg, small_jpeg)
+        print(f"{name:>12} {args.frames / elapsed:>10.0f} {size:>12}")
+
+    app.mobile_sessions.close(token)
+
+
+def lot_layout(count, width, height):
+    """Slot parkir tersusun grid, kira-kira seperti kamera yang melihat lahan dari atas"""
+    cols = max(1, math.ceil(math.sqrt(count * width / height)))
+    rows = max(1, math.ceil(count / cols))
+    cell_w = width / cols
+    cell_h = height / rows
+    slots = []
+    for i in range(count):
+        row, col = divmod(i, cols)
+        slots.append({
+            "id": f"slot_{i + 1}",
+            "x": col * cell_w + cell_w * 0.1,
+            "y": row * cell_h + cell_h * 0.1,
+            "w": cell_w * 0.8,
+            "h": cell_h * 0.8
+        })
+    return slots
+
+
+def write_synthetic_footage(path, count, width, height, fps, seconds, seed=0):
+    """Tulis rekaman lahan parkir sintetis (MJPG .avi, bisa di Linux headless)"""
+    rng = np.random.default_rng(seed)
+    slots = lot_layout(count, width, height)
+
+    background = np.clip(rng.normal(90, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+    for slot in slots:
+        x, y, w, h = (int(slot[k]) for k in ("x", "y", "w", "h"))
+        cv2.rectangle(background, (x, y), (x + w, y + h), (230, 230, 230), 2)
+
+    occupied = rng.random(count) < 0.5
+    colors = rng.integers(0, 255, (count, 3))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    for _ in range(int(fps * seconds)):
+        # Rata-rata satu perubahan slot tiap ~5 detik per slot
+        occupied ^= rng.random(count) < 1.0 / (5 * fps)
+        frame = background.copy()
+        for i in np.flatnonzero(occupied):
+            slot = slots[i]
+            x, y, w, h = (int(slot[k]) for k in ("x", "y", "w", "h"))
+            cv2.rectangle(frame, (x + w // 6, y + h // 6), (x + w - w // 6, y + h - h // 6),
+                          tuple(int(c) for c in colors[i]), -1)
+        writer.write(frame)
+    writer.release()
+    return slots, background
+
+
+def percentiles(samples):
+    p50, p90, p99 = np.percentile(np.asarray(samples) * 1000, [50, 90, 99])
+    return f"p50 {p50:.2f} ms  p90 {p90:.2f} ms  p99 {p99:.2f} ms"
+
+
+def bench_suite(args):
+    """Capture FPS, latency deteksi dan throughput encode MJPEG dari rekaman (replay)"""
+    if args.footage:
+        path = args.footage
+        with open(args.slots_json) as f:
+            slots = json.load(f)
+        background = None
+    else:
+        workdir = args.output or tempfile.mkdtemp(prefix="parking_bench_")
+        path = os.path.join(workdir, "synthetic_lot.avi")
+        print(f"Generating {args.seconds}s synthetic footage ({args.width}x{args.height}, {args.slots} slots) -> {path}")
+        slots, background = write_synthetic_footage(path, args.slots, args.width, args.height,
+                                                    args.fps, args.seconds)
+
+    realtime = "1" if args.realtime else "0"
+    pipeline = app.CameraPipeline("bench", f"file:{path}?realtime={realtime}")
+
+    # 1. Capture FPS lewat CaptureEngine (sama seperti kamera sungguhan)
+    pipeline.engine.start()
+    first_seq, frame = pipeline.engine.wait_frame(0, timeout=10.0)
+    start = time.perf_counter()
+    time.sleep(args.duration)
+    seq, _ = pipeline.engine.latest()
+    capture_fps = (seq - first_seq) / (time.perf_counter() - start)
+    print(f"capture:   {capture_fps:.1f} FPS")
+
+    # 2. MJPEG encode throughput (satu viewer, encode sekali per frame)
+    last_seq, chunks, total_bytes = 0, 0, 0
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        last_seq, chunk = pipeline.broadcaster.next_chunk(last_seq, timeout=0.5)
+        if chunk is not None:
+            chunks += 1
+            total_bytes += len(chunk)
+    print(f"mjpeg:     {chunks / args.duration:.1f} encodes/s, "
+          f"{total_bytes / max(chunks, 1) / 1024:.1f} KB/frame")
+    pipeline.engine.stop()
+
+    # 3. Latency deteksi per frame (dengan dan tanpa motion gate)
+    pipeline.apply_layout(app.SlotLayout.from_slots(slots))
+    pipeline.snapshot_path = None
+    pipeline.background.reset(background if background is not None else frame)
+    replay = app.ReplayCapture(path, realtime=False, loop=False)
+    gated, full = [], []
+    for _ in range(args.frames):
+        ret, frame = replay.read()
+        if not ret:
+            break
+        start = time.perf_counter()
+        pipeline.detect(frame)
+        gated.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        pipeline.detector.detect(pipeline.background.prepare(frame), pipeline.background.image)
+        full.append(time.perf_counter() - start)
+    replay.release()
+
+    print(f"detect:    {percentiles(full)}  ({len(full)} frames, {len(slots)} slots)")
+    print(f"gated:     {percentiles(gated)}  {pipeline.gate.counters}")
+    print(f"background: {pipeline.background.counters}")
+
+
+def bench_scale(args):
+    """Akurasi & CPU deteksi BGR / grayscale per skala vs deteksi BGR resolusi penuh (lama)"""
+    rng = np.random.default_rng(0)
+    slots = lot_layout(args.slots, args.width, args.height)
+    layout = app.SlotLayout.from_slots(slots)
+    background = np.clip(rng.normal(90, 6, (args.height, args.width, 3)), 0, 255).astype(np.uint8)
+
+    # Frame uji: ~separuh slot terisi mobil (ukuran/posisi/warna acak), noise sensor
+    # dan sedikit perubahan cahaya global
+    frames, truth = [], []
+    for _ in range(args.frames):
+        occupied = rng.random(len(slots)) < 0.5
+        frame = background.copy()
+        for i in np.flatnonzero(occupied):
+            x, y, w, h = (int(slots[i][k]) for k in ("x", "y", "w", "h"))
+            cw, ch = int(w * rng.uniform(0.4, 0.9)), int(h * rng.uniform(0.5, 0.9))
+            cx, cy = x + int(rng.integers(0, w - cw + 1)), y + int(rng.integers(0, h - ch + 1))
+            cv2.rectangle(frame, (cx, cy), (cx + cw, cy + ch), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        noise = rng.normal(rng.uniform(-8, 8), 4, frame.shape)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+        truth.append(dict(zip(layout.ids, ("occupied" if occ else "empty" for occ in occupied.tolist()))))
+
+    def run(name, detect):
+        correct = 0
+        start = time.process_time()
+        results = [detect(frame) for frame in frames]
+        cpu = (time.process_time() - start) / len(frames)
+        for result, expected in zip(results, truth):
+            correct += sum(result[slot_id] == state for slot_id, state in expected.items())
+        accuracy = correct / (len(frames) * len(slots))
+        print(f"{name:>10} {cpu * 1000:>10.2f} {accuracy * 100:>9.2f}%")
+
+    print(f"{args.width}x{args.height}, {len(slots)} slots, {len(frames)} frames")
+    print(f"{'mode':>10} {'cpu ms':>10} {'accuracy':>10}")
+
+    detector = app.SlotDetector(pixel_threshold=30)
+    detector.set_layout(layout)
+    run("lama", lambda frame: detector.detect(frame, background))
+
+    for color, threshold in ((True, args.threshold), (False, args.gray_threshold)):
+        for scale in args.scales:
+            model = app.BackgroundModel(scale=scale, color=color)
+            model.reset(background)
+            detector = app.SlotDetector(pixel_threshold=threshold)
+            detector.scale = scale
+            detector.set_layout(layout)
+            run(f"{'bgr' if color else 'gray'} {scale:g}x", lambda frame: detector.detect(model.prepare(frame), model.image))
+
+
+def bench_layout(args):
+    """Import/export layout besar lewat HTTP + load ulang dari disk (seperti restart)"""
+    app.layout_store.directory = tempfile.mkdtemp(prefix="layouts-")
+    client = app.app.test_client()
+    camera_id = "bench-layout"
+    pipeline = app.CameraPipeline(camera_id, url="file:/dev/null")
+    with app.camera_manager.lock:
+        app.camera_manager.cameras[camera_id] = pipeline
+
+    print(f"{'slots':>6} {'import ms':>10} {'export ms':>10} {'reload ms':>10} {'compile ms':>11} {'version':>8}")
+    for count in args.slots:
+        slots = lot_layout(count, args.width, args.height)
+        body = json.dumps({"slots": slots})
+
+        start = time.perf_counter()
+        response = client.put(f"/cameras/{camera_id}/layout", data=body, content_type="application/json")
+        import_time = time.perf_counter() - start
+        assert response.status_code == 200, response.get_json()
+
+        start = time.perf_counter()
+        exported = client.get(f"/cameras/{camera_id}/layout").get_json()
+        export_time = time.perf_counter() - start
+        assert len(exported["ids"]) == count
+
+        start = time.perf_counter()
+        layout = app.layout_store.load(camera_id)
+        reload_time = time.perf_counter() - start
+        assert layout.same_slots(pipeline.layout)
+
+        start = time.perf_counter()
+        layout.compile((args.height, args.width, 3))
+        compile_time = time.perf_counter() - start
+
+        print(f"{count:>6} {import_time * 1000:>10.1f} {export_time * 1000:>10.1f} "
+              f"{reload_time * 1000:>10.1f} {compile_time * 1000:>11.2f} {layout.version:>8}")
+
+    with app.camera_manager.lock:
+        app.camera_manager.cameras.pop(camera_id, None)
+
+
+def bench_clips(args):
+    """Biaya append ring rekaman per frame, export klip, dan batas disk ring + klip"""
+    app.CLIP_DIR = tempfile.mkdtemp(prefix="clips-")
+    app.CLIP_MAX_BYTES = args.max_clip_mb << 20
+    app.history_store = app.HistoryStore(os.path.join(app.CLIP_DIR, "history.db"))
+    frame = synthetic_lot(1, args.width, args.height)[0]
+    jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, app.RECORD_QUALITY])[1].tobytes()
+    recorder = app.ClipRecorder("bench-clips", None, None)
+    ring = app.RecordingRing(recorder.ring_path, args.ring_mb << 20)
+
+    append_times = []
+    start_ts = 1_000_000.0
+    for i in range(args.frames):
+        started = time.perf_counter()
+        ring.append(jpeg, start_ts + i / args.fps)
+        append_times.append(time.perf_counter() - started)
+    print(f"jpeg {len(jpeg)} B, ring {args.ring_mb} MB: {len(ring)} frame tersimpan "
+          f"({len(ring) / args.fps:.0f} s pada {args.fps} fps)")
+    p50, p99 = np.percentile(np.asarray(append_times) * 1e6, [50, 99])
+    print(f"append: p50 {p50:.1f} us  p99 {p99:.1f} us")
+
+    end_ts = start_ts + args.frames / args.fps
+    export_times = []
+    for i in range(args.clips):
+        ts = end_ts - app.CLIP_AFTER - i * 0.5
+        event = {"ts": ts + i * 1e-3, "start": ts - app.CLIP_BEFORE, "end": ts + app.CLIP_AFTER,
+                 "transitions": [(f"S{i}", ts, "occupied")]}
+        started = time.perf_counter()
+        recorder._export(ring, event)
+        export_times.append(time.perf_counter() - started)
+    ring.close()
+    clip_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(recorder.directory, "*")))
+    print(f"export: {percentiles(export_times)}")
+    print(f"disk: ring {os.path.getsize(recorder.ring_path) / 2**20:.1f} MB, klip {clip_bytes / 2**20:.1f} MB "
+          f"(batas {args.max_clip_mb} MB, {recorder.counters['pruned']} klip dipangkas)")
+    shutil.rmtree(app.CLIP_DIR, ignore_errors=True)
+
+
+async def mjpeg_viewer(host, port, path, start_at, deadline, stats):
+    """Satu viewer MJPEG lewat socket mentah: hitung frame dari boundary multipart"""
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(max(0.0, start_at - loop.time()))
+    opened = loop.time()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError as e:
+        stats["errors"].append(f"connect: {e}")
+        return
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), 10)
+        if b" 200 " not in status:
+            stats["errors"].append(f"status: {status.strip().decode(errors='replace')}")
+            return
+
+        marker = b"--frame"
+        frames, received, tail, first = 0, 0, b"", None
+        while loop.time() < deadline:
+            data = await asyncio.wait_for(reader.read(65536), max(0.1, deadline - loop.time()) + 5)
+            if not data:
+                stats["errors"].append("closed by server")
+                break
+            received += len(data)
+            count = (tail + data).count(marker)
+            if count and first is None:
+                first = loop.time() - opened
+            frames += count
+            tail = (tail + data)[-(len(marker) - 1):]
+        stats["frames"].append(frames)
+        stats["bytes"] += received
+        if first is not None:
+            stats["first_frame"].append(first)
+    except (asyncio.TimeoutError, OSError) as e:
+        stats["errors"].append(f"{type(e).__name__}: {e}")
+    finally:
+        writer.close()
+
+
+async def run_viewers(args, host, port, path):
+    loop = asyncio.get_running_loop()
+    stats = {"frames": [], "bytes": 0, "first_frame": [], "errors": []}
+    start = loop.time()
+    deadline = start + args.ramp + args.duration
+    await asyncio.gather(*(mjpeg_viewer(host, port, path, start + args.ramp * i / args.viewers, deadline, stats)
+                           for i in range(args.viewers)))
+    return stats
+
+
+def bench_viewers(args):
+    """Load test: N viewer MJPEG bersamaan ke server yang sedang jalan (asyncio, tanpa thread per viewer)"""
+    base = urlsplit(args.url)
+    host, port = base.hostname, base.port or 80
+    path = f"/cameras/{args.camera}/video" + (f"?profile={args.profile}" if args.profile else "")
+
+    if args.register:
+        body = json.dumps({"id": args.camera, "ip": args.register, "wait": False}).encode()
+        request = Request(f"{base.scheme}://{base.netloc}/cameras", data=body, method="POST",
+                          headers={"Content-Type": "application/json"})
+        with urlopen(request, timeout=30) as response:
+            print(f"registered {args.camera}: {response.read().decode().strip()}")
+
+    print(f"{args.viewers} viewers -> {base.scheme}://{base.netloc}{path} "
+          f"(ramp {args.ramp}s, {args.duration}s)")
+    cpu = process_cpu(args.pid) if args.pid else None
+    stats = asyncio.run(run_viewers(args, host, port, path))
+    if args.pid:
+        cpu = (process_cpu(args.pid) - cpu) / (args.duration + args.ramp) * 100
+
+    frames = np.asarray(stats["frames"] or [0]) / (args.duration + args.ramp / 2)
+    print(f"completed:   {len(stats['frames'])}/{args.viewers} viewers, {len(stats['errors'])} errors")
+    print(f"fps/viewer:  min {frames.min():.1f}  p50 {np.median(frames):.1f}  max {frames.max():.1f}")
+    print(f"throughput:  {stats['bytes'] / (args.duration + args.ramp / 2) / 1e6:.1f} MB/s total")
+    if args.pid:
+        print(f"server cpu:  {cpu:.1f} %")
+    if stats["first_frame"]:
+        print(f"first frame: {percentiles(stats['first_frame'])}")
+    for error in sorted(set(stats["errors"]))[:10]:
+        print(f"  error: {error} (x{stats['errors'].count(error)})")
+
+
+def process_cpu(pids):
+    """Total CPU (detik) proses server dari /proc, untuk membandingkan biaya mode polling"""
+    total = 0.0
+    for pid in pids:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total
+
+
+async def status_poller(host, port, path, mode, interval, start_at, deadline, stats):
+    """
+    Satu client /status: full = GET biasa tiap interval, etag = If-None-Match tiap
+    interval, longpoll = ?since=<etag>&wait= (server menahan sampai ada perubahan)
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(max(0.0, start_at - loop.time()))
+    etag = None
+    while loop.time() < deadline:
+        query, headers = path, ""
+        if mode == "longpoll":
+            query += f"?wait={interval}" + (f"&since={etag}" if etag else "")
+        elif mode == "etag" and etag:
+            headers = f'If-None-Match: "{etag}"\r\n'
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET {query} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n{headers}\r\n".encode())
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(-1), interval + 10)
+            writer.close()
+        except (asyncio.TimeoutError, OSError) as e:
+            stats["errors"].append(f"{type(e).__name__}: {e}")
+            await asyncio.sleep(1.0)
+            continue
+        head = data.split(b"\r\n\r\n", 1)[0]
+        status = head.split(b" ", 2)[1].decode() if b" " in head else "?"
+        stats["status"][status] = stats["status"].get(status, 0) + 1
+        stats["bytes"] += len(data)
+        match = re.search(rb'(?im)^etag: "?([^"\r\n]+)', head)
+        if match:
+            etag = match.group(1).decode()
+        if mode != "longpoll":
+            await asyncio.sleep(interval)
+
+
+async def run_pollers(args, host, port, path, mode):
+    loop = asyncio.get_running_loop()
+    stats = {"status": {}, "bytes": 0, "errors": []}
+    start = loop.time()
+    deadline = start + args.duration
+    await asyncio.gather(*(status_poller(host, port, path, mode, args.interval,
+                                         start + args.interval * i / args.clients, deadline, stats)
+                           for i in range(args.clients)))
+    return stats
+
+
+def bench_pollers(args):
+    """Load test /status: polling biasa vs ETag/304 vs long-poll, terhadap server yang sedang jalan"""
+    base = urlsplit(args.url)
+    host, port = base.hostname, base.port or 80
+    path = f"/cameras/{args.camera}/status"
+    print(f"{args.clients} clients -> {base.scheme}://{base.netloc}{path} "
+          f"(interval/wait {args.interval}s, {args.duration}s per mode)")
+    print(f"{'mode':>9} {'req/s':>8} {'KB/s':>8} {'cpu %':>7}  status")
+    for mode in args.mode:
+        cpu = process_cpu(args.pid) if args.pid else None
+        stats = asyncio.run(run_pollers(args, host, port, path, mode))
+        used = f"{(process_cpu(args.pid) - cpu) / args.duration * 100:7.1f}" if args.pid else f"{'-':>7}"
+        requests = sum(stats["status"].values())
+        print(f"{mode:>9} {requests / args.duration:8.1f} {stats['bytes'] / args.duration / 1e3:8.1f} {used}  "
+              f"{dict(sorted(stats['status'].items()))} errors {len(stats['errors'])}")
+        for error in sorted(set(stats["errors"]))[:5]:
+            print(f"  error: {error} (x{stats['errors'].count(error)})")
+
+
+STAMP_BITS = 40
+
+
+def stamp_frame(frame, ms):
+    """Tulis waktu (ms) sebagai 40 blok hitam/putih di baris atas; tahan kompresi JPEG"""
+    size = frame.shape[1] // STAMP_BITS
+    for bit in range(STAMP_BITS):
+        frame[:size, bit * size:(bit + 1) * size] = 255 if (ms >> bit) & 1 else 0
+
+
+def read_stamp(frame):
+    size = frame.shape[1] // STAMP_BITS
+    row = frame[size // 2, size // 2::size][:STAMP_BITS]
+    bits = (row.mean(axis=-1) if row.ndim == 2 else row) > 127
+    return sum(1 << bit for bit, on in enumerate(bits.tolist()) if on)
+
+
+def serve_stamped_mjpeg(width, height, fps):
+    """IP camera tiruan: MJPEG over HTTP, tiap frame berisi waktu saat di-encode"""
+    background = np.random.default_rng(0).integers(60, 120, (height, width, 3), dtype=np.uint8)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            self.end_headers()
+            frame = background.copy()
+            next_time = time.time()
+            try:
+                while True:
+                    stamp_frame(frame, int(time.time() * 1000) % (1 << STAMP_BITS))
+                    jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n"
+                                     % len(jpeg) + jpeg + b"\r\n")
+                    next_time += 1.0 / fps
+                    time.sleep(max(0.0, next_time - time.time()))
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/stream.mjpg"
+
+
+class SlowDecodeCapture:
+    """Bungkus VideoCapture: tambah waktu decode (CPU lemah / resolusi besar)"""
+
+    def __init__(self, cap, decode_s):
+        self.cap = cap
+        self.decode_s = decode_s
+
+    def read(self):
+        ret, frame = self.cap.read()
+        time.sleep(self.decode_s)
+        return ret, frame
+
+    def retrieve(self):
+        ret, frame = self.cap.retrieve()
+        time.sleep(self.decode_s)
+        return ret, frame
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+def legacy_reader(cam, stop, publish):
+    """Loop IP camera lama: read() lalu buang 2 frame dengan grab()"""
+    while not stop.is_set():
+        ret, frame = cam.read()
+        if ret:
+            publish(frame)
+            cam.grab()
+            cam.grab()
+
+
+def bench_latency(args):
+    """Latency kamera -> frame siap di server (stamp waktu di dalam frame), reader lama vs baru"""
+    server, url = serve_stamped_mjpeg(args.width, args.height, args.fps)
+    print(f"stamped MJPEG camera: {url} ({args.width}x{args.height} @ {args.fps} FPS)")
+    print(f"{'reader':>8} {'decode ms':>10} {'fps':>6} {'dropped':>8}  latency")
+
+    for decode_ms in args.decode_ms:
+        for reader in ("legacy", "live"):
+            latencies = []
+
+            def record(frame):
+                now_ms = int(time.time() * 1000) % (1 << STAMP_BITS)
+                latencies.append((now_ms - read_stamp(frame)) / 1000.0)
+
+            def opener():
+                return SlowDecodeCapture(cv2.VideoCapture(url, cv2.CAP_FFMPEG), decode_ms / 1000.0)
+
+            stop = Event()
+            if reader == "legacy":
+                cam = opener()
+                thread = Thread(target=legacy_reader, args=(cam, stop, record), daemon=True)
+                thread.start()
+                time.sleep(args.duration)
+                stop.set()
+                thread.join(5)
+                cam.release()
+                dropped = "-"
+            else:
+                engine = app.CaptureEngine(opener)
+                engine.ip_camera = True
+                engine.name = "latency"
+                engine.start()
+
+                def consume():
+                    seq = 0
+                    while not stop.is_set():
+                        new_seq, frame = engine.wait_frame(seq, 0.5)
+                        if frame is not None and new_seq != seq:
+                            record(frame)
+                        seq = new_seq
+
+                consumer = Thread(target=consume, daemon=True)
+                consumer.start()
+                time.sleep(args.duration)
+                stop.set()
+                consumer.join(2)
+                engine.stop()
+                dropped = str(engine.dropped)
+
+            # Buang 1 detik pertama (koneksi & probe FFMPEG)
+            samples = latencies[int(len(latencies) / args.duration):] or [0.0]
+            print(f"{reader:>8} {decode_ms:>10g} {len(latencies) / args.duration:>6.1f} {dropped:>8}  "
+                  f"{percentiles(samples)}")
+
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Parking benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("mjpeg", help="MJPEG encode fan-out")
+    p.add_argument("--viewers", type=int, nargs="+", default=[1, 5, 10, 25])
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--fps", type=int, default=30)
+    p.add_argument("--duration", type=float, default=3.0)
+    p.set_defaults(func=bench_mjpeg)
+
+    p = sub.add_parser("detect", help="Slot detection throughput")
+    p.add_argument("--slots", type=int, nargs="+", default=[10, 100, 1000])
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_detect)
+
+    p = sub.add_parser("mobile", help="Mobile frame ingest throughput")
+    p.add_argument("--frames", type=int, default=200)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.set_defaults(func=bench_mobile)
+
+    p = sub.add_parser("suite", help="Replay-based capture/detection/MJPEG benchmark")
+    p.add_argument("--footage", help="Rekaman sendiri (video / folder gambar); default: sintetis")
+    p.add_argument("--slots-json", help="Layout slot untuk --footage (list JSON seperti /update_slots)")
+    p.add_argument("--output", help="Folder untuk rekaman sintetis")
+    p.add_argument("--slots", type=int, default=50)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--fps", type=int, default=30)
+    p.add_argument("--seconds", type=float, default=10.0)
+    p.add_argument("--frames", type=int, default=300, help="Jumlah frame untuk latency deteksi")
+    p.add_argument("--duration", type=float, default=3.0)
+    p.add_argument("--realtime", action="store_true", help="Replay mengikuti FPS asli")
+    p.set_defaults(func=bench_suite)
+
+    p = sub.add_parser("scale", help="Detection accuracy/CPU per detection scale")
+    p.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5, 0.25])
+    p.add_argument("--slots", type=int, default=100)
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--frames", type=int, default=30)
+    p.add_argument("--threshold", type=int, default=25, help="pixel_threshold SlotDetector mode BGR")
+    p.add_argument("--gray-threshold", type=int, default=10, help="pixel_threshold SlotDetector mode grayscale")
+    p.set_defaults(func=bench_scale)
+
+    p = sub.add_parser("viewers", help="Concurrent MJPEG viewers against a running server")
+    p.add_argument("--url", default="http://127.0.0.1:5000")
+    p.add_argument("--camera", default="loadtest")
+    p.add_argument("--register", help="Daftarkan kamera dulu, mis. file:rekaman.mp4 atau URL IP camera")
+    p.add_argument("--viewers", type=int, default=500)
+    p.add_argument("--duration", type=float, default=20.0)
+    p.add_argument("--ramp", type=float, default=5.0, help="Detik untuk membuka semua koneksi")
+    p.add_argument("--profile", choices=list(app.STREAM_PROFILES), help="Profil stream (default server)")
+    p.add_argument("--pid", type=int, nargs="*", help="PID server untuk mengukur CPU")
+    p.set_defaults(func=bench_viewers)
+
+    p = sub.add_parser("pollers", help="Concurrent /status pollers: full vs ETag vs long-poll")
+    p.add_argument("--url", default="http://127.0.0.1:5000")
+    p.add_argument("--camera", default="loadtest")
+    p.add_argument("--clients", type=int, default=1000)
+    p.add_argument("--mode", nargs="+", default=["full", "etag", "longpoll"],
+                   choices=["full", "etag", "longpoll"])
+    p.add_argument("--interval", type=float, default=2.0, help="Detik antar poll / wait long-poll")
+    p.add_argument("--duration", type=float, default=20.0)
+    p.add_argument("--pid", type=int, nargs="*", help="PID server (dan worker) untuk mengukur CPU")
+    p.set_defaults(func=bench_pollers)
+
+    p = sub.add_parser("latency", help="IP camera reader latency (legacy frame_skip vs live reader)")
+    p.add_argument("--fps", type=int, default=30)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--decode-ms", type=float, nargs="+", default=[0, 60, 120],
+                   help="Waktu decode tambahan per frame (simulasi CPU lemah)")
+    p.add_argument("--duration", type=float, default=10.0)
+    p.set_defaults(func=bench_latency)
+
+    p = sub.add_parser("layout", help="Bulk layout import/export")
+    p.add_argument("--slots", type=int, nargs="+", default=[100, 1000, 5000])
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.set_defaults(func=bench_layout)
+
+    p = sub.add_parser("clips", help="Recording ring append + transition clip export")
+    p.add_argument("--frames", type=int, default=20000)
+    p.add_argument("--fps", type=float, default=app.RECORD_FPS or 5)
+    p.add_argument("--clips", type=int, default=200)
+    p.add_argument("--ring-mb", type=int, default=64)
+    p.add_argument("--max-clip-mb", type=int, default=50)
+    p.add_argument("--width", type=int, default=640)
+    p.add_argument("--height", type=int, default=360)
+    p.set_defaults(func=bench_clips)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
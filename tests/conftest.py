@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# app.py membaca konfigurasi saat import: arahkan database, layout, background
+# dan klip ke direktori sementara supaya test tidak menyentuh data di repo
+DATA_DIR = tempfile.mkdtemp(prefix="parking-test-")
+os.environ["HISTORY_DB"] = os.path.join(DATA_DIR, "history.db")
+os.environ["LAYOUT_DIR"] = os.path.join(DATA_DIR, "layouts")
+os.environ["BACKGROUND_DIR"] = os.path.join(DATA_DIR, "backgrounds")
+os.environ["CLIP_DIR"] = os.path.join(DATA_DIR, "clips")
+os.environ["RECORD_FPS"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
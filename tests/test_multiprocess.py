@@ -0,0 +1,166 @@
+"""
+Mode multi-proses tanpa subprocess: CameraSupervisor asli, proses kamera
+diganti CameraWorker di proses test (SharedRing + BusConnection socketpair),
+web worker = RemoteCameraManager lewat LocalBus ke CameraSupervisor.handle.
+"""
+import os
+import socket
+from threading import Thread
+
+import cv2
+import numpy as np
+import pytest
+
+import app
+from conftest import DATA_DIR
+
+SLOTS = [{"id": "A1", "x": 10, "y": 10, "w": 60, "h": 40},
+         {"id": "A2", "x": 100, "y": 10, "w": 60, "h": 40}]
+
+
+def make_source(name, value):
+    """Folder gambar 320x240 sebagai sumber replay (file:<folder>)"""
+    folder = os.path.join(DATA_DIR, name)
+    os.makedirs(folder, exist_ok=True)
+    for i in range(3):
+        cv2.imwrite(os.path.join(folder, f"{i:04d}.jpg"), np.full((240, 320, 3), value + i, np.uint8))
+    return f"file:{folder}?fps=20"
+
+
+def start_in_process(self, env):
+    """Pengganti CameraProcess.start: sama seperti run_camera_worker, tapi di thread"""
+    worker = app.CameraWorker(self.config)
+    worker.start()
+    ours, theirs = socket.socketpair()
+
+    def serve():
+        worker.serve(app.BusConnection(theirs))
+        worker.stop()  # ring di-unlink CameraProcess.stop, seperti proses yang exit
+
+    Thread(target=serve, daemon=True).start()
+    self.conn = app.BusConnection(ours)
+    self.ready.set()
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    monkeypatch.setattr(app.CameraProcess, "start", start_in_process)
+    supervisor = app.CameraSupervisor()
+    manager = app.RemoteCameraManager(app.LocalBus(supervisor.handle))
+    monkeypatch.setattr(app, "camera_manager", manager)
+    yield supervisor, manager, app.app.test_client()
+    for pipeline in list(manager.cameras.values()):
+        pipeline.close()
+    supervisor.stop()
+
+
+def add_camera(client, camera_id, source, **data):
+    response = client.post("/cameras", json=dict(data, id=camera_id, ip=source))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_shared_ring_roundtrip():
+    name = f"pktest{os.getpid()}"
+    writer = app.SharedRing(name, slots=2, slot_bytes=16, create=True)
+    reader = app.SharedRing(name)
+    try:
+        assert reader.read() == (0, 0.0, None)
+        assert writer.write(b"first", 100.0)
+        assert reader.read() == (1, 100.0, b"first")
+        assert not writer.write(b"x" * 17)  # lebih besar dari slot, dilewati
+        for payload in (b"second", b"third"):
+            writer.write(payload)
+        assert reader.seq() == 3
+        assert reader.read()[2] == b"third"
+        assert not writer.demand()
+        reader.touch()
+        assert writer.demand()
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_local_bus_passes_json():
+    bus = app.LocalBus(lambda message: {"echo": message, "items": ("a", "b")})
+    assert bus.request({"op": "list", "args": (1, 2)}) == {"echo": {"op": "list", "args": [1, 2]},
+                                                           "items": ["a", "b"]}
+
+
+def test_add_camera(remote):
+    supervisor, manager, client = remote
+    reply = add_camera(client, "lot", make_source("lot", 40))
+    assert reply["resolution"] == "320x240"
+
+    pipeline = manager.get("lot")
+    assert isinstance(pipeline, app.RemotePipeline)
+    assert pipeline.generation == supervisor.cameras["lot"].config["generation"]
+    assert [camera["id"] for camera in client.get("/cameras").get_json()["cameras"]] == ["lot"]
+
+    # Web worker lain melihat kamera yang sama lewat supervisor
+    other = app.RemoteCameraManager(app.LocalBus(supervisor.handle))
+    try:
+        assert other.get("lot").generation == pipeline.generation
+    finally:
+        other.get("lot").close()
+
+
+def test_set_slots_and_status_etag(remote):
+    supervisor, manager, client = remote
+    add_camera(client, "lot", make_source("lot", 40), wait=False)
+
+    response = client.post("/cameras/lot/slots", json={"slots": SLOTS})
+    assert response.status_code == 200
+    pipeline = manager.get("lot")
+    assert pipeline.layout.ids == ["A1", "A2"]
+    assert supervisor.handle({"op": "command", "id": "lot", "cmd": "layout"})["ids"] == ["A1", "A2"]
+
+    response = client.get("/cameras/lot/status")
+    assert response.status_code == 200
+    assert sorted(response.get_json()) == ["A1", "A2"]
+    etag = response.headers["ETag"]
+    assert client.get("/cameras/lot/status", headers={"If-None-Match": etag}).status_code == 304
+
+    # Layout baru -> ETag lama tidak berlaku lagi
+    client.post("/cameras/lot/slots", json={"slots": SLOTS[:1]})
+    response = client.get("/cameras/lot/status", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert list(response.get_json()) == ["A1"]
+
+    assert client.post("/cameras/lot/slots", json=[]).status_code == 400
+    assert pipeline.layout.ids == ["A1"]
+
+
+def test_generation_changes_after_reset(remote):
+    supervisor, manager, client = remote
+    add_camera(client, "lot", make_source("lot", 40), slots=SLOTS)
+    old = manager.get("lot")
+    etag = client.get("/cameras/lot/status").headers["ETag"]
+    other = app.RemoteCameraManager(app.LocalBus(supervisor.handle))
+    assert other.get("lot").generation == old.generation
+
+    # Reset background tidak mengganti proses kamera
+    assert client.post("/cameras/lot/reset_background").status_code == 200
+    assert manager.get("lot") is old
+
+    # Sumber baru -> proses kamera baru (generation baru), web worker ikut pindah
+    add_camera(client, "lot", make_source("street", 120))
+    pipeline = manager.get("lot")
+    assert pipeline is not old and old.closed
+    assert pipeline.generation == old.generation + 1
+    assert supervisor.cameras["lot"].config["discard_background"]
+
+    # Layout tetap (dari disk), client dengan ETag generation lama dapat status penuh
+    response = client.get("/cameras/lot/status", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert sorted(response.get_json()) == ["A1", "A2"]
+
+    # Worker lain yang masih memegang generation lama pindah saat sync berikutnya
+    previous = other.get("lot")
+    other.sync(force=True)
+    try:
+        assert other.get("lot").generation == pipeline.generation
+        assert previous.closed
+    finally:
+        other.get("lot").close()